@@ -1,171 +1,207 @@
-import streamlit as st
+import logging
+import os
+import numpy as np
 import pandas as pd
-from collections import Counter
-from io import BytesIO
-
-# Only import openpyxl if we do color-coding
-# (We will conditionally import it later if needed)
-
-def parse_list(input_str):
-    """Helper to parse a comma-separated string of integers."""
-    arr = []
-    for x in input_str.split(','):
-        x = x.strip()
-        if x.lstrip('-').isdigit():  # handle negative if needed
-            arr.append(int(x))
-    return arr
-
-def remove_nwis(sample_list, nwis):
-    """Remove any items from sample_list that appear in nwis."""
-    return [x for x in sample_list if x not in nwis]
-
-def is_valid_triple(A, B, C, counts, strict_switch, nwis):
-    """
-    Check if the triple (A, B, C) can be formed with available counts.
-    If strict_switch is True, apply extra checks involving nwis.
-    """
-    from collections import Counter
-    temp_counts = Counter([A, B, C])
-    
-    # If strict_switch is on, apply extra NWIS logic
-    if strict_switch:
-        if (B - 5) in nwis:
-            return False
-        if (C - B + 5) in nwis:
-            return False
-
-    # Check we have enough occurrences for each number
-    for num, req in temp_counts.items():
-        if counts.get(num, 0) < req:
-            return False
-    return True
-
-def is_valid_triple_single(M, S, T, Ext, Gen, counts, strict_switch, nwis):
-    """
-    Check if the triple (A, B, C) can be formed with available counts.
-    If strict_switch is True, apply extra checks involving nwis.
-    """
-    from collections import Counter
-    temp_counts = Counter([M, S, T, Ext, Gen])
-    
-    # If strict_switch is on, apply extra NWIS logic
-    if strict_switch:
-        if (M - 5) in nwis:
-            return False
-
-    # Check we have enough occurrences for each number
-    for num, req in temp_counts.items():
-        if counts.get(num, 0) < req:
-            return False
-    return True
-
-def is_valid_triple_dual(M, S, T, Ext, Gen, counts, strict_switch, nwis):
+import streamlit as st
+from contextlib import nullcontext
+from functools import partial
+
+from combinations_core import (
+    BIN_COLUMNS,
+    CANDIDATE_CACHE_SIZE,
+    COMBINATION_RULES,
+    DATA_EXPORTS,
+    DEFAULT_C_LIST,
+    DEFAULT_G,
+    DEFAULT_MAIN,
+    DEFAULT_NWIM,
+    DEFAULT_R,
+    LIST_FILE_TYPES,
+    PerfRecorder,
+    PipelineJob,
+    ResultCache,
+    RunCancelled,
+    SHARED_CACHE_MB,
+    SHARED_CANDIDATE_SHARE,
+    SHARED_CACHE_SIZE,
+    SHARED_CACHE_TTL,
+    export_bytes,
+    export_filename,
+    formatted_frame,
+    formatted_layout,
+    parse_int_array,
+    perf_stage,
+    pyarrow_available,
+    read_list_file,
+    result_cache_key,
+    result_positions,
+    run_pipeline,
+)
+
+def env_number(name, default):
+    """A numeric setting from the environment, e.g. COMBINATIONS_CACHE_SIZE=128."""
+    value = os.environ.get(name)
+    return type(default)(value) if value else default
+
+def cache_budget():
+    """(result bytes, candidate bytes) of the COMBINATIONS_CACHE_MB both shared caches fit in."""
+    budget = env_number("COMBINATIONS_CACHE_MB", SHARED_CACHE_MB) * 2**20
+    candidates = int(budget * SHARED_CANDIDATE_SHARE)
+    return budget - candidates, candidates
+
+@st.cache_resource
+def get_result_cache():
     """
-    Check if the triple (A, B, C) can be formed with available counts.
-    If strict_switch is True, apply extra checks involving nwis.
+    The ResultCache shared by every session of this server process, so users
+    running the same lists share one computation and one set of workbooks.
+    Sized by COMBINATIONS_CACHE_SIZE (entries), COMBINATIONS_CACHE_TTL
+    (seconds) and COMBINATIONS_CACHE_MB, which it shares with the candidates.
     """
-    from collections import Counter
-    temp_counts = Counter([M, S, T, Ext, Gen])
-    
-    # If strict_switch is on, apply extra NWIS logic
-    if strict_switch:
-        if (M - 5) in nwis:
-            return False
-        if (S-M+5) in nwis:
-            return False
+    return ResultCache(
+        env_number("COMBINATIONS_CACHE_SIZE", SHARED_CACHE_SIZE),
+        ttl=env_number("COMBINATIONS_CACHE_TTL", SHARED_CACHE_TTL),
+        max_bytes=cache_budget()[0],
+    )
 
-    # Check we have enough occurrences for each number
-    for num, req in temp_counts.items():
-        if counts.get(num, 0) < req:
-            return False
-    return True
+@st.cache_resource
+def get_candidate_cache():
+    """Unfiltered candidates of recent runs (of any session), so NWIS / toggle changes only re-filter."""
+    return ResultCache(CANDIDATE_CACHE_SIZE, ttl=env_number("COMBINATIONS_CACHE_TTL", SHARED_CACHE_TTL),
+                       max_bytes=cache_budget()[1])
 
-def is_valid_triple_double_dual(M, S, T, Ext, Gen, counts, strict_switch, nwis):
-    """
-    Check if the triple (A, B, C) can be formed with available counts.
-    If strict_switch is True, apply extra checks involving nwis.
-    """
-    from collections import Counter
-    temp_counts = Counter([M, S, T, Ext, Gen])
-    
-    # If strict_switch is on, apply extra NWIS logic
-    if strict_switch:
-        if (M - 15) in nwis:
-            return False
-        if (S - M + 15) in nwis:
-            return False
+# Rows shown in the live preview while the enumeration is running
+PREVIEW_ROWS = 1000
 
-    # Check we have enough occurrences for each number
-    for num, req in temp_counts.items():
-        if counts.get(num, 0) < req:
-            return False
-    return True
+# Seconds between two looks at a background run
+POLL_SECONDS = 0.25
 
-def is_valid_triple_double_single(M, S, T, Ext, Gen, counts, strict_switch, nwis):
+def follow_job(run):
     """
-    Check if the triple (A, B, C) can be formed with available counts.
-    If strict_switch is True, apply extra checks involving nwis.
+    A progress bar, a Cancel button and a table of the rows found so far for
+    the session's background run, refreshed until it finishes. Returns
+    (result, cached) once it has, None if it was cancelled, and re-raises
+    what the run raised. A rerun (any widget change) stops the polling, not
+    the run: the next script run picks the job up again.
     """
-    from collections import Counter
-    temp_counts = Counter([M, S, T, Ext, Gen])
-    
-    # If strict_switch is on, apply extra NWIS logic
-    if strict_switch:
-        if (S - 1) in nwis:
-            return False
-
-    # Check we have enough occurrences for each number
-    for num, req in temp_counts.items():
-        if counts.get(num, 0) < req:
-            return False
-    return True
-
-def is_valid_double(A, B, counts, strict_switch, nwis):
+    job = run['job']
+    if not job.wait(POLL_SECONDS):  # cache hits finish before any of this is drawn
+        if st.button("Cancel", key="cancel_run"):
+            job.cancel()
+        else:
+            columns = COMBINATION_RULES[run['method']].tuple_columns + BIN_COLUMNS
+            progress_bar = st.progress(0.0, text="Enumerating combinations...")
+            table = st.empty()
+            shown = 0
+            while not job.wait(POLL_SECONDS):
+                progress_bar.progress(job.progress, text=f"Enumerating combinations... {job.rows} valid rows so far")
+                if len(job.preview) > shown:
+                    shown = len(job.preview)
+                    table.dataframe(pd.DataFrame(
+                        np.vstack([np.hstack([tuples, bins]) for tuples, bins in job.preview[:shown]]),
+                        columns=columns))
+            progress_bar.empty()
+            table.empty()
+    del st.session_state["run"]
+    if job.done() and job.error is None:
+        return job.result
+    if job.cancelled or isinstance(job.error, RunCancelled):
+        st.info("Run cancelled.")
+        return None
+    raise job.error
+
+def list_upload(label):
+    """Optional file that replaces the text of a list input."""
+    return st.file_uploader(f"...or upload the {label} (CSV, xlsx or txt)", type=list(LIST_FILE_TYPES))
+
+def read_list_input(label, text, upload, warn=True):
+    """The integers of a list input (upload first, else the text), warning about malformed entries."""
+    if upload is not None:
+        values, malformed = read_list_file(upload.name, upload.getvalue())
+    else:
+        values, malformed = parse_int_array(text)
+    if malformed and warn:
+        shown = ", ".join(repr(token) for token in malformed[:10])
+        more = f" and {len(malformed) - 10} more" if len(malformed) > 10 else ""
+        st.warning(f"{label}: skipped {len(malformed)} malformed entries: {shown}{more}")
+    return values.tolist()
+
+# One JSON line per run when "Log performance as JSON" is on
+perf_logger = logging.getLogger("combinations.perf")
+if not perf_logger.handlers:
+    perf_logger.addHandler(logging.StreamHandler())
+    perf_logger.setLevel(logging.INFO)
+
+def recorded_perf(result, perf, cached):
+    """The PerfRecorder of a run: for a cached result, the one of the run that computed it (if any)."""
+    return result['perf'] if cached and result['perf'] is not None else perf
+
+def log_performance(result, perf, cached):
+    """The JSON line of a finished run, logged once when it finishes (not on every rerun showing it)."""
+    recorded = recorded_perf(result, perf, cached)
+    if recorded is not None:
+        perf_logger.info(recorded.to_json(method=result['method'], X1=result['X1'], X2=result['X2'],
+                                          top_k=result['top_k'], cached=cached))
+
+def performance_panel(result, perf, cached):
     """
-    Check if the double (A, B) can be formed with available counts.
-    If strict_switch is True, apply extra checks involving nwis.
+    Expander with the stage timings, peak memory and rejection counts.
+    A cached result shows the recorder of the run that computed it (and
+    this run's parsing); workbook builds appear once they have been downloaded.
     """
-    from collections import Counter
-    temp_counts = Counter([A, B])
-    
-    # If strict_switch is on, apply extra NWIS logic
-    if strict_switch:
-        if (B - 1) in nwis:
-            return False
-
-    # Check we have enough occurrences for each number
-    for num, req in temp_counts.items():
-        if counts.get(num, 0) < req:
-            return False
-    return True
-
-def compute_bins(triple, Main, G, R, C_list):
+    recorded = recorded_perf(result, perf, cached)
+    if recorded is None:
+        st.caption("Performance panel: run again to record this configuration.")
+        return
+    with st.expander("Performance", expanded=True):
+        if cached and result['perf'] is not None:
+            st.caption("Served from the result cache: the pipeline stages are from the run that computed it.")
+        elif cached:
+            st.caption("Served from the result cache, computed with the panel off: only parsing was measured.")
+        stages = dict(recorded.stages)
+        if cached and perf is not None and 'parse' in perf.stages:
+            stages['parse'] = perf.stages['parse']
+        table = pd.DataFrame.from_dict(stages, orient='index')[['seconds', 'peak_mb', 'calls']]
+        # tracemalloc sees every thread: concurrent sessions add to the peaks
+        st.dataframe(table.rename(columns={'peak_mb': 'peak_mb (process-wide)'}))
+        st.dataframe(pd.Series(recorded.counts, name='count', dtype='int64'))
+
+PAGE_SIZES = [25, 50, 100, 250, 1000]
+RANK_ORDER = "(rank)"
+NO_FILTER = "(none)"
+
+def paginated_results(result):
     """
-    Calculate how many numbers in the triple come from
-    each bin: [Main, G, R, C_list].
+    Page, sort and filter controls for df_with_inter. Returns the rows of
+    the current page and the Combinations Visualized row number its first
+    block starts at; only that slice is sent to the browser.
     """
-    bins = [0, 0, 0, 0]  # [Priority_count, 2nd_count, 3rd_count, Backup_count]
-
-    # Copies so original data is not modified
-    main_copy = Main.copy()
-    g_copy    = G.copy()
-    r_copy    = R.copy()
-    c_copy    = C_list.copy()
-
-    for num in triple:
-        if num in main_copy:
-            bins[0] += 1
-            main_copy.remove(num)
-        elif num in g_copy:
-            bins[1] += 1
-            g_copy.remove(num)
-        elif num in r_copy:
-            bins[2] += 1
-            r_copy.remove(num)
-        elif num in c_copy:
-            bins[3] += 1
-            c_copy.remove(num)
-    return bins
+    df_with_inter = result['df_with_inter']
+    numeric = [c for c in df_with_inter.columns if c != '']
+    cols = st.columns(4)
+    page_size = cols[0].selectbox("Rows per page", PAGE_SIZES, index=1)
+    sort_by = cols[1].selectbox("Sort by", [RANK_ORDER] + numeric)
+    descending = cols[2].toggle("Descending", value=False, disabled=sort_by == RANK_ORDER)
+    filter_column = cols[3].selectbox("Filter column", [NO_FILTER] + numeric)
+
+    filter_range = None
+    if filter_column == NO_FILTER or not len(df_with_inter):
+        filter_column = None
+    else:
+        column = df_with_inter[filter_column]
+        low, high = st.columns(2)
+        filter_range = (low.number_input(f"{filter_column} from", value=int(column.min()), step=1),
+                        high.number_input(f"{filter_column} to", value=int(column.max()), step=1))
+
+    positions = result_positions(df_with_inter, None if sort_by == RANK_ORDER else sort_by, descending,
+                                 filter_column, filter_range)
+    pages = max(1, -(-len(positions) // page_size))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1)
+    first = (page - 1) * page_size
+    page_rows = df_with_inter.iloc[positions[first:first + page_size]]
+    st.caption(f"Rows {min(first + 1, len(positions))}-{first + len(page_rows)} of {len(positions)}")
+    # Every result is its block rows and a blank one in Combinations Visualized
+    block_rows, _, _ = formatted_layout(result['method'], result['X1'], result['X2'])
+    return page_rows, first * (len(block_rows) + 1) + 1
 
 def main():
     st.title("Number Combinations Generator")
@@ -317,918 +353,172 @@ def main():
     # Get numeric input from user
     X1 = st.number_input("Enter X1", value=5, step=1)
     X2 = st.number_input("Enter X2", value=15, step=1)
+    top_k = st.number_input("Show top K results (0 = all)", value=0, min_value=0, step=100)
     # strict_switch = st.checkbox("Enable strict_switch (NWIS check in intermediate steps)", value=False)
     # default_main = "1,3,5,9,11,13,15,16,21,23,24,25,29,31,32,33,35,37,39,41,45,47,48,52,57,65,67,68,82"
-    default_main = "1,3,5,11,13,15,16,21,23,24,25,29,31,32,33,35,37,39,41,45,47,48,52,57,65,67,68,82"
+    default_main = DEFAULT_MAIN
     main_str = st.text_area("Priority list", default_main, height=80)
+    main_file = list_upload("Priority list")
 
     # default_g = "3,5,6,11,13,15,16,24,31,32,35"
-    default_g = "15,16,23,24,32,33,41"
+    default_g = DEFAULT_G
 
     g_str = st.text_area("2nd list", default_g, height=80)
+    g_file = list_upload("2nd list")
 
     # default_r = "4,10,12,14,15,16,20,22,23,24,28,32,33,34,41"
-    default_r = "3,5,6,11,13,15,16,24,31,32,35"
+    default_r = DEFAULT_R
 
     r_str = st.text_area("3rd list", default_r, height=80)
+    r_file = list_upload("3rd list")
 
     # default_c_list = "12,14,22,32"
-    default_c_list = "6,7,17,18,38,51,55,61,75"
+    default_c_list = DEFAULT_C_LIST
     c_list_str = st.text_area("Backup list", default_c_list, height=80)
+    c_list_file = list_upload("Backup list")
 
     # default_nwim = "2,4,9,10,12,14,19,20,26,27,28,34,36,42,43,44,46,49,50,53,54,56,58,59,60,62,64,66,69,70,72,73,74,76,78,79,80,21,23,26,28,29,33,39,22,4,10,12,22,28,34,4,9,10,14,19,20,28,34,44,9,10,14,19,20,22,28,30,34,40,44,50,53,54,56,59,60,70,80"
-    default_nwim = "2,4,9,10,12,14,19,20,22,26,27,28,30,34,36,40,42,43,44,46,49,50,53,54,56,58,59,60,62,64,66,69,70,72,73,74,76,78,79,80"
+    default_nwim = DEFAULT_NWIM
 
     nwim_str = st.text_area("Not Wanted List", default_nwim, height=100)
-    if st.button("Run Combinations Logic"):
-        # Parse user inputs
-        not_wanted_in_sum = parse_list(nwim_str)
-        nwis = list(set(not_wanted_in_sum))
+    nwim_file = list_upload("Not Wanted List")
+    # Per-stage timings, counts and memory; also switched on by ?perf=1
+    show_perf = st.toggle("Show performance panel", value=st.query_params.get("perf") == "1")
+    log_perf = show_perf and st.toggle("Log performance as JSON", value=False)
+
+    toggles = (toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E)
+    # What the inputs hold now, cheap to compare: the list texts, or the ids of uploaded files
+    list_inputs = [("Not Wanted List", nwim_str, nwim_file), ("Priority list", main_str, main_file),
+                   ("2nd list", g_str, g_file), ("3rd list", r_str, r_file), ("Backup list", c_list_str, c_list_file)]
+    widgets = (method_selection, X1, X2, toggles, top_k,
+               *[text if upload is None else upload.file_id for _, text, upload in list_inputs])
+    current = {}
+
+    def matches_widgets(entry):
+        """Whether a run (or shown result) was made from what the inputs hold now."""
+        if entry['widgets'] == widgets:
+            return True
+        if 'key' not in current:  # e.g. only reformatted lists: parse them to be sure
+            not_wanted, *lists = [read_list_input(*list_input, warn=False) for list_input in list_inputs]
+            current['key'] = result_cache_key(method_selection, X1, X2, toggles, *lists, not_wanted, top_k)
+        return entry['key'] == current['key']
 
-        Main   = parse_list(main_str)
-        G      = parse_list(g_str)
-        R      = parse_list(r_str)
-        C_list = parse_list(c_list_str)
+    if st.button("Run Combinations Logic"):
+        perf = PerfRecorder() if show_perf else None
+        with perf if perf is not None else nullcontext():
+            # Parse user inputs
+            with perf_stage(perf, 'parse'):
+                not_wanted_in_sum = read_list_input("Not Wanted List", nwim_str, nwim_file)
+
+                Main   = read_list_input("Priority list", main_str, main_file)
+                G      = read_list_input("2nd list", g_str, g_file)
+                R      = read_list_input("3rd list", r_str, r_file)
+                C_list = read_list_input("Backup list", c_list_str, c_list_file)
+
+        cache = get_result_cache()
+        candidate_cache = get_candidate_cache()
+        key = result_cache_key(method_selection, X1, X2, toggles, Main, G, R, C_list, not_wanted_in_sum, top_k)
+
+        def compute(on_block):
+            with perf if perf is not None else nullcontext():
+                # Another session already running the same inputs is waited for, not repeated
+                return cache.get_or_compute(key, lambda: run_pipeline(
+                    method_selection, X1, X2, toggles, Main, G, R, C_list, not_wanted_in_sum, top_k,
+                    on_block=on_block, perf=perf, candidate_cache=candidate_cache))
+
+        # The compute runs off the script thread; a new run supersedes the session's previous one
+        run = st.session_state.get("run")
+        if run is None or run['key'] != key:
+            if run is not None:
+                run['job'].cancel()
+            st.session_state["run"] = {'job': PipelineJob(key, compute, PREVIEW_ROWS), 'key': key,
+                                       'widgets': widgets, 'method': method_selection, 'perf': perf}
+
+    run = st.session_state.get("run")
+    if run is not None and not run['job'].done() and not matches_widgets(run):
+        # An input changed mid-run, so its result would no longer match the page
+        run['job'].cancel()
+        del st.session_state["run"]
+        st.info("The inputs changed while the combinations were running, so that run was cancelled. "
+                "Press Run Combinations Logic to start one with the new inputs.")
+    elif run is not None:
+        finished = follow_job(run)
+        if finished is not None:
+            result, cached = finished
+            if log_perf:
+                log_performance(result, run['perf'], cached)
+            # Keep the run on screen while the table controls below rerun the page
+            st.session_state["shown_run"] = {'result': result, 'perf': run['perf'], 'cached': cached,
+                                             'key': run['key'], 'widgets': run['widgets']}
+
+    shown_run = st.session_state.get("shown_run")
+    if shown_run is not None:
+        if not matches_widgets(shown_run):
+            st.warning("The inputs have changed since these results were computed. "
+                       "Press Run Combinations Logic to update them.")
+        result, perf, cached = shown_run['result'], shown_run['perf'], shown_run['cached']
+        cache = get_result_cache()
+        df_with_inter = result['df_with_inter']
+        st.success(result['message'])
+        st.write(f"Number of valid rows: {len(df_with_inter)}")
+        if result['top_k']:
+            st.caption(f"Top {result['top_k']} mode: only the best ranked rows are kept.")
+        page_rows, first_index = paginated_results(result)
+        st.dataframe(page_rows)
+        st.write("Combinations Visualized:")
+        st.dataframe(formatted_frame(result['method'], result['X1'], result['X2'], page_rows, first_index))
 
         # ---------------------------------------------------------------
-        # 4) MAIN LOGIC
+        # 5) SAVE FIRST FILE: valid_combinations.xlsx (built on download)
         # ---------------------------------------------------------------
-        # 4a) Filter out NWIS items
-        # Main   = remove_nwis(Main, nwis)
-        # G      = remove_nwis(G, nwis)
-        # R      = remove_nwis(R, nwis)
-        # C_list = remove_nwis(C_list, nwis)
-
-        # 4b) Create a major list and get counts
-        major_list = Main + G + R + C_list
-        counts = Counter(major_list)
-        unique_sorted = sorted(counts.keys())
-        
-        if method_selection == 'single':
-
-            valid_triples = []
-            temp_skip = False
-            # X1 = 5
-            Gen = 6
-            Ext = 2
-            if Gen in counts and Ext in counts:
-                if toggle_G and Gen in nwis:
-                    temp_skip = True                    
-                if toggle_E and Ext in nwis:                
-                    temp_skip = True                    
-
-                if not temp_skip:
-                    for M in unique_sorted:
-                        if toggle_M_S and M in nwis:
-                            continue
-
-                        if not M > X1:
-                            continue
-                        
-                        S = M - X1 + 1
-                        if S not in counts:
-                            continue
-                        if toggle_M_S and S in nwis:
-                            continue
-                        
-                        T = M
-                        if toggle_T and T in nwis:
-                            continue
-                        if is_valid_triple_single(M, S, T, Ext, Gen, counts, strict_switch, nwis):
-                            valid_triples.append((M, S, T, Ext, Gen))                            
-            # valid_triples = []
-            # temp_skip = False
-            # Gen = 6
-            # Ext = 2
-            # if Gen in counts and Ext in counts:
-            #     if toggle_G and Gen in nwis:
-            #         temp_skip = True                    
-            #     if toggle_E and Ext in nwis:                
-            #         temp_skip = True                    
-
-            #     if not temp_skip:
-            #         for M in unique_sorted:
-            #             if toggle_M_S and M in nwis:
-            #                 continue
-
-            #             if not M > 5:
-            #                 continue
-                        
-            #             S = M - 4
-            #             if S not in counts:
-            #                 continue
-            #             if toggle_M_S and S in nwis:
-            #                 continue
-                        
-            #             T = M
-            #             if toggle_T and T in nwis:
-            #                 continue
-            #             if is_valid_triple_single(M, S, T, Ext, Gen, counts, strict_switch, nwis):
-            #                 valid_triples.append((M, S, T, Ext, Gen))                            
-            
-            # 4d) Sort the triples and build a dataframe
-            triple_bins = [
-                (triple, compute_bins(triple, Main, G, R, C_list)) 
-                for triple in valid_triples
-            ]
-            # triple_bins_sorted = sorted(triple_bins, key=lambda x: x[0][0])
-            # triple_bins_sorted = sorted(
-            #     triple_bins,
-            #     key=lambda x: (-x[1][0], -x[1][1], -x[1][2], -x[1][3], x[0])
-            # )            
-            triple_bins_sorted = sorted(
-                triple_bins,
-                key=lambda x: (
-                    -x[1][0], -x[1][1], -x[1][2], -x[1][3],   # bins descending
-                    sum(x[0]),                               # sum ascending
-                    x[0][0], x[0][1], x[0][2], x[0][3], x[0][4]  # M, S, T, Ext, Gen ascending
-                )
-            )
-
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                # A, B, C_ = triple
-                M, S, T, Ext, Gen = triple
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen] + bins_count)
-
-            columns = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df = pd.DataFrame(rows, columns=columns)
-
-            # Keep only rows that used exactly 3 items
-            df = df[df[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            # With intermediate values
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                # M, S, T = triple
-                M, S, T, Ext, Gen = triple
-
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen]+[M-X1, 0] + bins_count +[sum([M, S, T, Ext, Gen])])
-
-            columns_triple = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen','M1','M2', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count','Sum(M,S,T,E,G)']
-            df_with_inter = pd.DataFrame(rows, columns=columns_triple)
-
-            # Keep only rows that used exactly 3 items
-            df_with_inter = df_with_inter[df_with_inter[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            st.success("Combinations generated!")
-
-            st.write(f"Number of valid rows: {len(df_with_inter)}")
-            df_with_inter.index = range(1, len(df_with_inter) + 1)
-            st.dataframe(df_with_inter)  # Show a sample
-
-            # Creating the new DataFrame with empty spaces
-            new_rows = []
-            for _, row in df_with_inter.iterrows():
-                new_rows.append([X1, row['M1'], row['M2'],'', row['Total'], '', row['Priority_count'], row['2nd_count'], row['3rd_count'], row['Backup_count']])
-                new_rows.append([row['Gen'], row['Main'], row['Subsidary'],row['Ext'], '', '', 'Priority', '2nd', '3rd', 'Backup'])
-                new_rows.append([''] * 10)  # Empty row
-
-            # Creating the new DataFrame
-            columns_triple = ['Gen', 'Main', 'Subsidary','Exterior','Total','--', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df_formatted = pd.DataFrame(new_rows, columns=columns_triple)
-            df_formatted.index = range(1, len(df_formatted) + 1)
-            st.write("Combinations Visualized:")
-            st.dataframe(df_formatted)  # Show a sample
-
-        elif method_selection == 'dual':
-
-            valid_triples = []
-            temp_skip = False
-            # X1 = 5
-            Gen = X1 + 1
-            if Gen in counts:
-                if toggle_G and Gen in nwis:
-                    temp_skip = True                    
-                # if toggle_E and Ext in nwis:                
-                #     temp_skip = True           
-                
-                if not temp_skip:
-                    for M in unique_sorted:
-                        if toggle_M_S and M in nwis:
-                            continue
-                        if not M > X1:
-                            continue
-                        
-                        M1 = M - X1
-                        for S in unique_sorted:
-                            if not S > M1:
-                                continue
-                            
-                            T = S + X1
-                            if T not in counts:
-                                continue                        
-                            if toggle_T and T in nwis:
-                                continue
-                            
-                            Ext = S - M + X1 + 1
-                            if Ext not in counts:
-                                continue          
-                            if toggle_E and Ext in nwis:
-                                continue
-  
-                            if is_valid_triple_dual(M, S, T, Ext, Gen, counts, strict_switch, nwis):
-                                valid_triples.append((M, S, T, Ext, Gen))                                    
-
-                         
-            
-            # 4d) Sort the triples and build a dataframe
-            triple_bins = [
-                (triple, compute_bins(triple, Main, G, R, C_list)) 
-                for triple in valid_triples
-            ]
-            # triple_bins_sorted = sorted(
-            #     triple_bins,
-            #     key=lambda x: (
-            #         -x[1][0], -x[1][1], -x[1][2], -x[1][3], 
-            #         sum(x[0])  # sum of (M, S, T, Ext, Gen)
-            #     )
-            # )
-            triple_bins_sorted = sorted(
-                triple_bins,
-                key=lambda x: (
-                    -x[1][0], -x[1][1], -x[1][2], -x[1][3],   # bins descending
-                    sum(x[0]),                               # sum ascending
-                    x[0][0], x[0][1], x[0][2], x[0][3], x[0][4]  # M, S, T, Ext, Gen ascending
-                )
-            )
-
-
-
-
-            # triple_bins_sorted = sorted(triple_bins, key=lambda x: x[0][0])
-
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                # A, B, C_ = triple
-                M, S, T, Ext, Gen = triple
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen] + bins_count)
-
-            columns = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df = pd.DataFrame(rows, columns=columns)
-
-            # Keep only rows that used exactly 3 items
-            df = df[df[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            # With intermediate values
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                M, S, T, Ext, Gen = triple
-
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen]+[M-X1, S-M+X1] + bins_count +[sum([M, S, T, Ext, Gen])])
-
-            columns_triple = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen','M1','M2', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count','Sum(M,S,T,E,G)']
-            df_with_inter = pd.DataFrame(rows, columns=columns_triple)
-
-            # Keep only rows that used exactly 3 items
-            df_with_inter = df_with_inter[df_with_inter[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            st.success("Combinations generated!")
-
-            st.write(f"Number of valid rows: {len(df_with_inter)}")
-            df_with_inter.index = range(1, len(df_with_inter) + 1)
-            st.dataframe(df_with_inter)  # Show a sample
-
-            # Creating the new DataFrame with empty spaces
-            new_rows = []
-            for _, row in df_with_inter.iterrows():
-                # new_rows.append([5, row['M1'], row['M2'], row['Total'], '', row['Priority_count'], row['2nd_count'], row['3rd_count'], row['Backup_count']])
-                # new_rows.append([''] * 9)  # Empty row
-                new_rows.append([X1, row['M1'], row['M2'],'', row['Total'], '', row['Priority_count'], row['2nd_count'], row['3rd_count'], row['Backup_count']])
-                new_rows.append([row['Gen'], row['Main'], row['Subsidary'],row['Ext'], '', '', 'Priority', '2nd', '3rd', 'Backup'])
-                new_rows.append([''] * 10)  # Empty row                
-
-            # Creating the new DataFrame
-            columns_triple = ['Gen', 'Main', 'Subsidary','Exterior','Total','--', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df_formatted = pd.DataFrame(new_rows, columns=columns_triple)
-            df_formatted.index = range(1, len(df_formatted) + 1)
-            st.write("Combinations Visualized:")
-            st.dataframe(df_formatted)  # Show a sample
-        
-        elif method_selection == 'double_single':
-
-            valid_triples = []
-            temp_skip = False
-            # X1 = 5
-            # X2 = 8
-            Gen = X1 + 1
-            Ext = Gen
-            if Gen in counts:
-                if toggle_G and Gen in nwis:
-                    temp_skip = True                    
-                if toggle_E and Ext in nwis:                
-                    temp_skip = True           
-                
-                if not temp_skip:            
-                    for M in unique_sorted:
-                        if toggle_M_S and M in nwis:
-                            continue
-                        if not M > X2:
-                            continue
-                        
-                        S = M - X2 + 1
-                        if S not in counts:
-                            continue
-                        if toggle_M_S and S in nwis:
-                            continue
-
-                        T = X1 + M
-                        if T not in counts:
-                            continue    
-                        if toggle_T and T in nwis:
-                            continue
-
-                        # if is_valid_triple_dual(M, S, T, counts, strict_switch, nwis):
-                        #     valid_triples.append((M, S, T))   
-                        if is_valid_triple_double_single(M, S, T, Ext, Gen, counts, strict_switch, nwis):
-                            valid_triples.append((M, S, T, Ext, Gen))                              
-
-                         
-            
-            # 4d) Sort the triples and build a dataframe
-            triple_bins = [
-                (triple, compute_bins(triple, Main, G, R, C_list)) 
-                for triple in valid_triples
-            ]
-            triple_bins_sorted = sorted(
-                triple_bins,
-                key=lambda x: (
-                    -x[1][0], -x[1][1], -x[1][2], -x[1][3],   # bins descending
-                    sum(x[0]),                               # sum ascending
-                    x[0][0], x[0][1], x[0][2], x[0][3], x[0][4]  # M, S, T, Ext, Gen ascending
-                )
-            )
-
-
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                # A, B, C_ = triple
-                M, S, T, Ext, Gen = triple
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen] + bins_count)
-
-            columns = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df = pd.DataFrame(rows, columns=columns)
-
-            # Keep only rows that used exactly 3 items
-            df = df[df[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            # With intermediate values
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                M, S, T, Ext, Gen = triple
-
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen]+[S-1] + bins_count +[sum([M, S, T, Ext, Gen])])
-
-            columns_triple = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen', 'M1', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count','Sum(M,S,T,E,G)']
-            df_with_inter = pd.DataFrame(rows, columns=columns_triple)
-
-            # Keep only rows that used exactly 3 items
-            df_with_inter = df_with_inter[df_with_inter[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            st.success("Combinations generated!")
-
-            st.write(f"Number of valid rows: {len(df_with_inter)}")
-            df_with_inter.index = range(1, len(df_with_inter) + 1)
-            st.dataframe(df_with_inter)  # Show a sample
-
-            # Creating the new DataFrame with empty spaces
-            new_rows = []
-            for _, row in df_with_inter.iterrows():
-                new_rows.append([X1, X2, row['M1'],'', row['Total'], '', row['Priority_count'], row['2nd_count'], row['3rd_count'], row['Backup_count']])
-                new_rows.append([row['Gen'], row['Main'], row['Subsidary'],row['Ext'], '', '', 'Priority', '2nd', '3rd', 'Backup'])
-                new_rows.append([''] * 10 )  # Empty row
-
-            # Creating the new DataFrame
-            columns_triple = ['Gen', 'Main', 'Subsidary','Exterior','Total','--', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df_formatted = pd.DataFrame(new_rows, columns=columns_triple)
-            df_formatted.index = range(1, len(df_formatted) + 1)
-            st.write("Combinations Visualized:")
-            st.dataframe(df_formatted)  # Show a sample
-
-
-        elif method_selection == 'double_dual':
-
-            valid_triples = []
-            temp_skip = False
-            # X1 = 5
-            # X2 = 15            
-            Gen = X1 + 1
-            if Gen in counts:
-                if toggle_G and Gen in nwis:
-                    temp_skip = True                    
-                # if toggle_E and Ext in nwis:                
-                #     temp_skip = True           
-                
-                if not temp_skip:            
-                    for M in unique_sorted:
-                        if toggle_M_S and M in nwis:
-                            continue
-                        if not M > X2:
-                            continue
-                        
-                        M1 = M - X2
-                        for S in unique_sorted:
-                            if not S > M1:
-                                continue
-                            
-                            T = S + X1 + X2
-                            if T not in counts:
-                                continue                        
-                            if toggle_T and T in nwis:
-                                continue
-
-                            Ext = S - M + X1 + X2
-                            if Ext not in counts:
-                                continue          
-                            if toggle_E and Ext in nwis:
-                                continue
-
-                            if is_valid_triple_double_dual(M, S, T, Ext, Gen, counts, strict_switch, nwis):
-                                valid_triples.append((M, S, T, Ext, Gen))   
-
-                         
-            
-            # 4d) Sort the triples and build a dataframe
-            triple_bins = [
-                (triple, compute_bins(triple, Main, G, R, C_list)) 
-                for triple in valid_triples
-            ]
-            # Sort by bins in descending priority order
-            triple_bins_sorted = sorted(
-                triple_bins,
-                key=lambda x: (
-                    -x[1][0], -x[1][1], -x[1][2], -x[1][3],   # bins descending
-                    sum(x[0]),                               # sum ascending
-                    x[0][0], x[0][1], x[0][2], x[0][3], x[0][4]  # M, S, T, Ext, Gen ascending
-                )
-            )
-
-
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                # A, B, C_ = triple
-                M, S, T, Ext, Gen = triple
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen] + bins_count)
-
-            columns = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df = pd.DataFrame(rows, columns=columns)
-
-            # Keep only rows that used exactly 3 items
-            df = df[df[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            # With intermediate values
-            rows = []
-            for triple, bins_count in triple_bins_sorted:
-                M, S, T, Ext, Gen = triple
-
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([M, S, T, Ext, Gen]+[M-X2, S-M+X2] + bins_count +[sum([M, S, T, Ext, Gen])])
-
-            columns_triple = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen','M1','M2', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count','Sum(M,S,T,E,G)']
-            df_with_inter = pd.DataFrame(rows, columns=columns_triple)
-
-            # Keep only rows that used exactly 3 items
-            df_with_inter = df_with_inter[df_with_inter[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 5]
-            
-            st.success("Combinations generated!")
-
-            st.write(f"Number of valid rows: {len(df_with_inter)}")
-            df_with_inter.index = range(1, len(df_with_inter) + 1)
-            st.dataframe(df_with_inter)  # Show a sample
-
-            # Creating the new DataFrame with empty spaces 
-            new_rows = []
-            for _, row in df_with_inter.iterrows():
-                new_rows.append([X1,X2, row['M1'], row['M2'],'', row['Total'], '', row['Priority_count'], row['2nd_count'], row['3rd_count'], row['Backup_count']])
-                new_rows.append([row['Gen'], row['Main'], row['Subsidary'], '',row['Ext'],'', '', 'Priority', '2nd', '3rd', 'Backup'])
-                new_rows.append([''] * 10)  # Empty row
-
-            # Creating the new DataFrame
-            columns_triple = ['Gen', 'Main', 'Subsidary','---','Exterior','Total','--', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df_formatted = pd.DataFrame(new_rows, columns=columns_triple)
-            df_formatted.index = range(1, len(df_formatted) + 1)
-            st.write("Combinations Visualized:")
-            st.dataframe(df_formatted)  # Show a sample
-                    
-        else:
-            # 4c) Generate valid triples
-            valid_doubles = []
-            for B in unique_sorted:
-                if toggle_M_S and B in nwis:
-                    continue                
-                A = B + 4  # Condition from the original code
-                if A not in counts:
-                    continue
-                if toggle_T and A in nwis:
-                    continue                
-                if B > 1:
-                    if is_valid_double(A, B, counts, strict_switch, nwis):
-                        valid_doubles.append((A, B))                        
-
-        
-            double_bins = [
-                (double, compute_bins(double, Main, G, R, C_list)) 
-                for double in valid_doubles
-            ]
-            double_bins_sorted = sorted(double_bins, key=lambda x: x[0][0])
-
-            rows = []
-            for double, bins_count in double_bins_sorted:
-                A, B = double
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([B, '', A] + bins_count)
-
-            columns = ['B', '', 'SUM', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df = pd.DataFrame(rows, columns=columns)
-            # Keep only rows that used exactly 3 items
-            df = df[df[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 2]
-            
-            rows = []
-            for double, bins_count in double_bins_sorted:
-                A, B = double
-                # Row: [B, C, A] + [Priority_count, 2nd_count, 3rd_count, Backup_count]
-                rows.append([B, '', A,B-1] + bins_count)
-
-            columns = ['B', '', 'SUM','M1', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df_with_inter = pd.DataFrame(rows, columns=columns)
-            # Keep only rows that used exactly 3 items
-            df_with_inter = df_with_inter[df_with_inter[['Priority_count', '2nd_count', '3rd_count', 'Backup_count']].sum(axis=1) == 2]
-            
-
-            st.success("Combinations generated Double!")
-            st.write(f"Number of valid rows: {len(df_with_inter)}")
-            df_with_inter.index = range(1, len(df_with_inter) + 1)
-            st.dataframe(df_with_inter)  # Show a sample
-
-            # Creating the new DataFrame with empty spaces
-            new_rows = []
-            for _, row in df_with_inter.iterrows():
-                new_rows.append(['', row['B'], '', '', '', 'Priority', '2nd', '3rd', 'Backup'])
-                new_rows.append([5, row['M1'], '', row['SUM'], '', row['Priority_count'], row['2nd_count'], row['3rd_count'], row['Backup_count']])
-                new_rows.append([''] * 9)  # Empty row
-
-            # Creating the new DataFrame
-            columns_triple = ['-', 'B', '','SUM','--', 'Priority_count', '2nd_count', '3rd_count', 'Backup_count']
-            df_formatted = pd.DataFrame(new_rows, columns=columns_triple)
-            df_formatted.index = range(1, len(df_formatted) + 1)
-            st.write("Combinations Visualized:")
-            st.dataframe(df_formatted)  # Show a sample
-
-
-            # ---------------------------------------------------------------
-            # 5) SAVE FIRST FILE: valid_combinations_final.xlsx (in memory)
-            # ---------------------------------------------------------------
         if save_valid:
-            valid_buffer = BytesIO()
-            # Adjust file name for strict if needed
-            valid_filename = "valid_combinations.xlsx"
-            if strict_switch:
-                valid_filename = "valid_combinations_strict.xlsx"      
-            valid_filename = f"{method_selection}_{valid_filename}"      
-            df_with_inter.to_excel(valid_buffer, index=False)
-            valid_buffer.seek(0)
+            valid_filename = result['filenames']['valid']
             st.download_button(
                 label=f"Download {valid_filename}",
-                data=valid_buffer,
+                data=partial(export_bytes, result, 'valid'),
                 file_name=valid_filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore",
             )
 
         # ---------------------------------------------------------------
-        # 7) SAVE THIRD FILE: visualized_with_color.xlsx (in memory)
+        # 7) SAVE THIRD FILE: visualized_with_color.xlsx (built on download)
         # ---------------------------------------------------------------
         if save_with_color:
-            # We'll build the colored Excel directly with openpyxl
-            from openpyxl import Workbook
-            from openpyxl.styles import PatternFill
-            from openpyxl.styles import Alignment
-
-
-            wb = Workbook()
-            ws = wb.active
-            center = Alignment(horizontal="center", vertical="center")
-
-            # Define color fills
-            green_fill  = PatternFill(start_color="92D051", fill_type="solid")
-            blue_fill   = PatternFill(start_color="06B0F0", fill_type="solid")
-            yellow_fill = PatternFill(start_color="FFFF00", fill_type="solid")
-            light_blue_fill = PatternFill(start_color="CAEDFB", fill_type="solid")
-            purple_fill = PatternFill(start_color="D86DCD", fill_type="solid")
-            tea_green_fill = PatternFill(start_color="C0F0C8", fill_type="solid")
-            orange_fill = PatternFill(start_color="FFBF00", fill_type="solid")
-            peach_fill = PatternFill(start_color="F1A983", fill_type="solid")
-
-            # We want to replicate the same 3-row block structure
-            idx = 0  # to iterate over df rows in groups of 1 (each row = one triple in df)
-            row_idx = 1
-            if method_selection == 'single':
-                while idx < len(df):
-                    M_val = df.iloc[idx]['Main']
-                    S_val = df.iloc[idx]['Subsidary']
-                    T_val = df.iloc[idx]['Total']
-                    G_val = df.iloc[idx]['Gen']
-                    E_val = df.iloc[idx]['Ext']
-                    M1_val = df_with_inter.iloc[idx]['M1']
-
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="X").fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value="M1").fill = yellow_fill
-                    ws.cell(row=row_idx, column=4, value="")
-                    ws.cell(row=row_idx, column=5, value="")
-                    ws.cell(row=row_idx, column=6, value="Dual").fill = purple_fill
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    row_idx = row_idx + 1
-                    # The top row
-                    ws.cell(row=row_idx, column=1, value="(M,S,T,E,G)")
-                    ws.cell(row=row_idx, column=2, value=X1).fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value=M1_val).fill = yellow_fill
-                    ws.cell(row=row_idx, column=4, value="")
-                    ws.cell(row=row_idx, column=5, value="")
-                    ws.cell(row=row_idx, column=6, value=T_val).fill = orange_fill
-                    ws.cell(row=row_idx, column=7, value="")
-                    ws.cell(row=row_idx, column=8, value="Priority")
-                    ws.cell(row=row_idx, column=9, value="2nd")
-                    ws.cell(row=row_idx, column=10, value="3rd")
-                    ws.cell(row=row_idx, column=11, value="Backup")
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    # The second row
-                    triple_str = f"({M_val}, {S_val}, {T_val}, {E_val}, {G_val})"
-                    row_idx = row_idx + 1
-                    ws.cell(row=row_idx, column=1, value=triple_str)
-                    ws.cell(row=row_idx, column=2, value=G_val).fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value=M_val).fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value=S_val).fill = green_fill
-                    ws.cell(row=row_idx, column=5, value=E_val).fill = tea_green_fill
-                    ws.cell(row=row_idx, column=6, value="").fill = orange_fill
-                    ws.cell(row=row_idx, column=7, value="")
-                    # ws.cell(row=row_2, column=5, value=T_val).fill = yellow_fill
-
-                    # We also want to show counts in columns 7..10:
-                    ws.cell(row=row_idx, column=8, value=df.iloc[idx]['Priority_count'])
-                    ws.cell(row=row_idx, column=9, value=df.iloc[idx]['2nd_count'])
-                    ws.cell(row=row_idx, column=10, value=df.iloc[idx]['3rd_count'])
-                    ws.cell(row=row_idx, column=11, value=df.iloc[idx]['Backup_count'])
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-
-                    row_idx+=1
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="Gen").fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value="Main").fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value="Subsidary").fill = green_fill
-                    ws.cell(row=row_idx, column=5, value="Exterior").fill = tea_green_fill
-                    ws.cell(row=row_idx, column=6, value="Total").fill = orange_fill
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    # The third row is blank
-                    for c in range(1, 12):
-                        ws.cell(row=row_idx+2, column=c, value="")
-
-                    # Move to the next triple
-                    row_idx += 3
-                    idx += 1
-
-            elif method_selection == 'dual':
-                while idx < len(df):
-                    M_val = df.iloc[idx]['Main']
-                    S_val = df.iloc[idx]['Subsidary']
-                    T_val = df.iloc[idx]['Total']
-                    G_val = df.iloc[idx]['Gen']
-                    E_val = df.iloc[idx]['Ext']
-                    M1_val = df_with_inter.iloc[idx]['M1']
-                    M2_val = df_with_inter.iloc[idx]['M2']                    
-
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="X").fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value="M1").fill = yellow_fill
-                    ws.cell(row=row_idx, column=4, value="M2").fill = peach_fill
-                    ws.cell(row=row_idx, column=5, value="")
-                    ws.cell(row=row_idx, column=6, value="Dual").fill = purple_fill
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    row_idx = row_idx + 1
-                    # The top row
-                    ws.cell(row=row_idx, column=1, value="(M,S,T,E,G)")
-                    ws.cell(row=row_idx, column=2, value=X1).fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value=M1_val).fill = yellow_fill
-                    ws.cell(row=row_idx, column=4, value=M2_val).fill = peach_fill
-                    ws.cell(row=row_idx, column=5, value="")
-                    ws.cell(row=row_idx, column=6, value=T_val).fill = orange_fill
-                    ws.cell(row=row_idx, column=7, value="")
-                    ws.cell(row=row_idx, column=8, value="Priority")
-                    ws.cell(row=row_idx, column=9, value="2nd")
-                    ws.cell(row=row_idx, column=10, value="3rd")
-                    ws.cell(row=row_idx, column=11, value="Backup")
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    # The second row
-                    triple_str = f"({M_val}, {S_val}, {T_val}, {E_val}, {G_val})"
-                    row_idx = row_idx + 1
-                    ws.cell(row=row_idx, column=1, value=triple_str)
-                    ws.cell(row=row_idx, column=2, value=G_val).fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value=M_val).fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value=S_val).fill = green_fill
-                    ws.cell(row=row_idx, column=5, value=E_val).fill = tea_green_fill
-                    ws.cell(row=row_idx, column=6, value="").fill = orange_fill
-                    ws.cell(row=row_idx, column=7, value="")
-                    # ws.cell(row=row_2, column=5, value=T_val).fill = yellow_fill
-
-                    # We also want to show counts in columns 7..10:
-                    ws.cell(row=row_idx, column=8, value=df.iloc[idx]['Priority_count'])
-                    ws.cell(row=row_idx, column=9, value=df.iloc[idx]['2nd_count'])
-                    ws.cell(row=row_idx, column=10, value=df.iloc[idx]['3rd_count'])
-                    ws.cell(row=row_idx, column=11, value=df.iloc[idx]['Backup_count'])
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-
-                    row_idx+=1
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="Gen").fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value="Main").fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value="Subsidary").fill = green_fill
-                    ws.cell(row=row_idx, column=5, value="Exterior").fill = tea_green_fill
-                    ws.cell(row=row_idx, column=6, value="Total").fill = orange_fill
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    # The third row is blank
-                    for c in range(1, 12):
-                        ws.cell(row=row_idx+2, column=c, value="")
-
-                    # Move to the next triple
-                    row_idx += 3
-                    idx += 1
-            elif method_selection == 'double_single':
-                while idx < len(df):
-                    M_val = df.iloc[idx]['Main']
-                    S_val = df.iloc[idx]['Subsidary']
-                    T_val = df.iloc[idx]['Total']
-                    G_val = df.iloc[idx]['Gen']
-                    E_val = df.iloc[idx]['Ext']
-                    M1_val = df_with_inter.iloc[idx]['M1']
-
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="X1").fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value="X2").fill = blue_fill
-                    ws.cell(row=row_idx, column=4, value="M1").fill = yellow_fill
-                    ws.cell(row=row_idx, column=5, value="")
-                    ws.cell(row=row_idx, column=6, value="Double Single").fill = purple_fill
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    row_idx = row_idx + 1
-                    # The top row
-                    ws.cell(row=row_idx, column=1, value="(M,S,T,E,G)")
-                    ws.cell(row=row_idx, column=2, value=X1).fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value=X2).fill = blue_fill
-                    ws.cell(row=row_idx, column=4, value=M1_val).fill = yellow_fill
-                    ws.cell(row=row_idx, column=5, value="")
-                    ws.cell(row=row_idx, column=6, value=T_val).fill = orange_fill
-                    ws.cell(row=row_idx, column=7, value="")
-                    ws.cell(row=row_idx, column=8, value="Priority")
-                    ws.cell(row=row_idx, column=9, value="2nd")
-                    ws.cell(row=row_idx, column=10, value="3rd")
-                    ws.cell(row=row_idx, column=11, value="Backup")
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    # The second row
-                    triple_str = f"({M_val}, {S_val}, {T_val}, {E_val}, {G_val})"
-                    row_idx = row_idx + 1
-                    ws.cell(row=row_idx, column=1, value=triple_str)
-                    ws.cell(row=row_idx, column=2, value=G_val).fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value=M_val).fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value=S_val).fill = green_fill
-                    ws.cell(row=row_idx, column=5, value=E_val).fill = tea_green_fill
-                    ws.cell(row=row_idx, column=6, value="").fill = orange_fill
-                    ws.cell(row=row_idx, column=7, value="")
-                    # ws.cell(row=row_2, column=5, value=T_val).fill = yellow_fill
-
-                    # We also want to show counts in columns 7..10:
-                    ws.cell(row=row_idx, column=8, value=df.iloc[idx]['Priority_count'])
-                    ws.cell(row=row_idx, column=9, value=df.iloc[idx]['2nd_count'])
-                    ws.cell(row=row_idx, column=10, value=df.iloc[idx]['3rd_count'])
-                    ws.cell(row=row_idx, column=11, value=df.iloc[idx]['Backup_count'])
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-
-                    row_idx+=1
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="Gen").fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value="Main").fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value="Subsidary").fill = green_fill
-                    ws.cell(row=row_idx, column=5, value="Exterior").fill = tea_green_fill
-                    ws.cell(row=row_idx, column=6, value="Total").fill = orange_fill
-                    for col in range(1, 12):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    # The third row is blank
-                    for c in range(1, 12):
-                        ws.cell(row=row_idx+2, column=c, value="")
-
-                    # Move to the next triple
-                    row_idx += 3
-                    idx += 1
-
-            elif method_selection == 'double_dual':
-                while idx < len(df):
-                    M_val = df.iloc[idx]['Main']
-                    S_val = df.iloc[idx]['Subsidary']
-                    T_val = df.iloc[idx]['Total']
-                    G_val = df.iloc[idx]['Gen']
-                    E_val = df.iloc[idx]['Ext']
-                    M1_val = df_with_inter.iloc[idx]['M1']
-                    M2_val = df_with_inter.iloc[idx]['M2']
-
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="X1").fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value="X2").fill = blue_fill
-                    ws.cell(row=row_idx, column=4, value="M1").fill = yellow_fill
-                    ws.cell(row=row_idx, column=5, value="M2").fill = peach_fill
-                    ws.cell(row=row_idx, column=6, value="")
-                    ws.cell(row=row_idx, column=7, value="Double Dual").fill = purple_fill
-                    for col in range(1, 13):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    row_idx = row_idx + 1
-                    # The top row
-                    ws.cell(row=row_idx, column=1, value="(M,S,T,E,G)")
-                    ws.cell(row=row_idx, column=2, value=X1).fill = blue_fill
-                    ws.cell(row=row_idx, column=3, value=X2).fill = blue_fill
-                    ws.cell(row=row_idx, column=4, value=M1_val).fill = yellow_fill
-                    ws.cell(row=row_idx, column=5, value=M2_val).fill = peach_fill
-                    ws.cell(row=row_idx, column=6, value="")
-                    ws.cell(row=row_idx, column=7, value=T_val).fill = orange_fill
-                    ws.cell(row=row_idx, column=8, value="")
-                    ws.cell(row=row_idx, column=9, value="Priority")
-                    ws.cell(row=row_idx, column=10, value="2nd")
-                    ws.cell(row=row_idx, column=11, value="3rd")
-                    ws.cell(row=row_idx, column=12, value="Backup")
-                    for col in range(1, 13):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    
-                    # The second row
-                    triple_str = f"({M_val}, {S_val}, {T_val}, {E_val}, {G_val})"
-                    row_idx = row_idx + 1
-                    ws.cell(row=row_idx, column=1, value=triple_str)
-                    ws.cell(row=row_idx, column=2, value=G_val).fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value=M_val).fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value=S_val).fill = green_fill
-                    ws.cell(row=row_idx, column=5, value="").fill = green_fill
-                    ws.cell(row=row_idx, column=6, value=E_val).fill = tea_green_fill
-                    ws.cell(row=row_idx, column=7, value="").fill = orange_fill
-                    ws.cell(row=row_idx, column=8, value="")
-                    ws.cell(row=row_idx, column=9, value=df.iloc[idx]['Priority_count'])
-                    ws.cell(row=row_idx, column=10, value=df.iloc[idx]['2nd_count'])
-                    ws.cell(row=row_idx, column=11, value=df.iloc[idx]['3rd_count'])
-                    ws.cell(row=row_idx, column=12, value=df.iloc[idx]['Backup_count'])
-                    for col in range(1, 13):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-
-                    row_idx+=1
-                    ws.cell(row=row_idx, column=1, value="")
-                    ws.cell(row=row_idx, column=2, value="Gen").fill = light_blue_fill
-                    ws.cell(row=row_idx, column=3, value="Main").fill = purple_fill
-                    ws.cell(row=row_idx, column=4, value="Subsidary").fill = green_fill
-                    ws.cell(row=row_idx, column=5, value="").fill = green_fill
-                    ws.cell(row=row_idx, column=6, value="Exterior").fill = tea_green_fill
-                    ws.cell(row=row_idx, column=7, value="Total").fill = orange_fill
-                    for col in range(1, 13):               # 1–11 in your snippet
-                        ws.cell(row=row_idx, column=col).alignment = center
-                    # The third row is blank
-                    for c in range(1, 13):
-                        ws.cell(row=row_idx+2, column=c, value="")
-
-                    # Move to the next triple
-                    row_idx += 3
-                    idx += 1
-
-            color_buffer = BytesIO()
-            color_filename = "visualized_with_color.xlsx"
-            if strict_switch:
-                color_filename = "visualized_with_color_strict.xlsx"
-            color_filename = f"{method_selection}_{color_filename}"
-            wb.save(color_buffer)
-            color_buffer.seek(0)
-
+            color_filename = result['filenames']['color']
             st.download_button(
                 label=f"Download {color_filename}",
-                data=color_buffer,
+                data=partial(export_bytes, result, 'color'),
                 file_name=color_filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore",
+            )
+
+        # ---------------------------------------------------------------
+        # 8) DATA EXPORTS: CSV, gzip'd CSV, Parquet, Arrow (built on download)
+        # ---------------------------------------------------------------
+        data_kinds = [kind for kind in DATA_EXPORTS
+                      if kind in ('csv', 'csv_gz') or pyarrow_available()]
+        for column, kind in zip(st.columns(len(data_kinds)), data_kinds):
+            filename = export_filename(result, kind)
+            column.download_button(
+                label=f"Download {DATA_EXPORTS[kind][0].lstrip('.').upper()}",
+                data=partial(export_bytes, result, kind),
+                file_name=filename,
+                mime=DATA_EXPORTS[kind][1],
+                on_click="ignore",
+                help=filename,
             )
 
+        st.caption(
+            f"Result cache: {cache.hits} hits, {cache.misses} misses, "
+            f"{len(cache)}/{cache.max_entries} entries, {cache.nbytes() / 2**20:.1f} MB "
+            f"+ {get_candidate_cache().nbytes() / 2**20:.1f} MB of candidates (shared by all sessions)"
+        )
+
+        if show_perf:
+            performance_panel(result, perf, cached)
+
         # st.success("All done!")
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""
+Benchmark: the original nested M x S Python loop for 'dual' / 'double_dual'
+against the searchsorted join that iter_candidate_blocks makes of their rules.
+
+Lists are synthetic: --sizes distinct values spread over --spread times
+that range, so the candidate grid is U^2 while valid results stay sparse.
+
+    python benchmarks/bench_dual_join.py --sizes 2000 5000 10000 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from combinations_core import (  # noqa: E402
+    ENUMERATORS,
+    ExclusionIndex,
+    is_valid_triple_double_dual,
+    is_valid_triple_dual,
+)
+
+
+def legacy_enumerate(counts, nwis, M_offset, T_offset, E_offset, Gen, validator,
+                     toggle_M_S, strict_switch, toggle_T, toggle_E):
+    """The loop main() used before the NumPy path, kept here as the reference."""
+    unique_sorted = sorted(counts.keys())
+    valid_triples = []
+    for M in unique_sorted:
+        if toggle_M_S and M in nwis:
+            continue
+        if not M > M_offset:
+            continue
+
+        M1 = M - M_offset
+        for S in unique_sorted:
+            if not S > M1:
+                continue
+
+            T = S + T_offset
+            if T not in counts:
+                continue
+            if toggle_T and T in nwis:
+                continue
+
+            Ext = S - M + E_offset
+            if Ext not in counts:
+                continue
+            if toggle_E and Ext in nwis:
+                continue
+
+            if validator(M, S, T, Ext, Gen, counts, strict_switch, nwis):
+                valid_triples.append((M, S, T, Ext, Gen))
+    return valid_triples
+
+
+def make_counts(n_values, spread, gen, seed):
+    rnd = random.Random(seed)
+    values = rnd.sample(range(1, n_values * spread), n_values)
+    # Duplicate a slice so multiplicity checks are exercised, and make sure Gen is present
+    return Counter(values + values[: n_values // 10] + [gen])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 5000, 10000])
+    parser.add_argument("--spread", type=int, default=20)
+    parser.add_argument("--legacy-max", type=int, default=10000, help="largest size timed with the Python loop")
+    parser.add_argument("--X1", type=int, default=5)
+    parser.add_argument("--X2", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    X1, X2 = args.X1, args.X2
+    modes = {
+        "dual": dict(M_offset=X1, T_offset=X1, E_offset=X1 + 1),
+        "double_dual": dict(M_offset=X2, T_offset=X1 + X2, E_offset=X1 + X2),
+    }
+    validators = {"dual": is_valid_triple_dual, "double_dual": is_valid_triple_double_dual}
+    toggles = dict(toggle_M_S=True, strict_switch=True, toggle_T=False, toggle_E=True)
+
+    print(f"{'method':<13}{'values':>8}{'legacy s':>11}{'join s':>10}{'speedup':>9}{'rows':>8}")
+    for size in args.sizes:
+        Gen = X1 + 1
+        counts = make_counts(size, args.spread, Gen, args.seed)
+        nwis = ExclusionIndex(random.Random(args.seed + 1).sample(range(1, size * args.spread), size // 2))
+        for method, offsets in modes.items():
+            start = time.perf_counter()
+            rows = ENUMERATORS[method](counts, nwis, X1, X2, toggles['toggle_M_S'], toggles['strict_switch'],
+                                       toggles['toggle_T'], False, toggles['toggle_E'])
+            joined = time.perf_counter() - start
+
+            legacy, speedup = "-", "-"
+            if size <= args.legacy_max:
+                start = time.perf_counter()
+                expected = legacy_enumerate(counts, nwis, Gen=Gen, validator=validators[method],
+                                            **offsets, **toggles)
+                legacy_s = time.perf_counter() - start
+                assert expected == rows, f"{method}: join and loop disagree"
+                legacy, speedup = f"{legacy_s:.3f}", f"{legacy_s / max(joined, 1e-9):.0f}x"
+            print(f"{method:<13}{size:>8}{legacy:>11}{joined:>10.4f}{speedup:>9}{len(rows):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: enumeration cost as the Not Wanted List grows.
+
+Times the enumeration of every method (ENUMERATORS) with the NWIS held as
+an ExclusionIndex, and (up to --legacy-max entries) through ListScan, which
+answers every lookup by scanning the plain list the app used to build, so
+the linear `in nwis` cost shows up next to the indexed lookups.
+
+    python benchmarks/bench_nwis.py --values 3000 --nwis 10 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from combinations_core import ENUMERATORS, ExclusionIndex  # noqa: E402
+
+
+class ListScan(ExclusionIndex):
+    """
+    The Not Wanted List as the plain list the app used to build, kept as the
+    reference: scalar and vectorized lookups both scan it value by value.
+    """
+    def __init__(self, values):
+        super().__init__([])
+        self.raw = list(values)
+
+    def __contains__(self, num):
+        return num in self.raw
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def mask(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        found = [value in self.raw for value in values.ravel().tolist()]
+        return np.array(found, dtype=bool).reshape(values.shape)
+
+
+def make_counts(n_values, seed):
+    rnd = random.Random(seed)
+    major_list = [rnd.randint(1, n_values * 2) for _ in range(n_values * 2)]
+    return Counter(major_list)
+
+
+def make_nwis(length, n_values, seed):
+    # Draw from a wider range than the lists so most entries never match
+    rnd = random.Random(seed + 1)
+    return list({rnd.randint(1, max(length, n_values) * 4) for _ in range(length)})
+
+
+def time_call(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--values", type=int, default=3000, help="approximate number of distinct list values")
+    parser.add_argument("--nwis", type=int, nargs="+", default=[10, 1000, 10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=10000, help="largest NWIS timed with the list-based path")
+    parser.add_argument("--X1", type=int, default=5)
+    parser.add_argument("--X2", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    counts = make_counts(args.values, args.seed)
+    # Gen = X1 + 1 has to be in the lists for the dual modes to produce anything
+    counts[args.X1 + 1] += 1
+    toggles = (True, True, True, False, True)  # M/S, strict, T, G, E
+
+    print(f"{len(counts)} distinct values")
+    print(f"{'method':<14}{'nwis':>8}{'index s':>12}{'list s':>12}{'rows':>8}")
+    for method, enumerate_fn in ENUMERATORS.items():
+        for length in args.nwis:
+            raw = make_nwis(length, args.values, args.seed)
+            indexed, rows = time_call(enumerate_fn, counts, ExclusionIndex(raw), args.X1, args.X2, *toggles)
+            legacy = "-"
+            if length <= args.legacy_max:
+                legacy_s, legacy_rows = time_call(enumerate_fn, counts, ListScan(raw), args.X1, args.X2, *toggles)
+                assert legacy_rows == rows
+                legacy = f"{legacy_s:.4f}"
+            print(f"{method:<14}{length:>8}{indexed:>12.4f}{legacy:>12}{rows:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Benchmark: every method end to end, broken down by pipeline stage.
+
+Synthetic Priority/2nd/3rd/Backup/Not Wanted lists are generated per size
+(values drawn from a range --spread times the list length, --dup of each
+list repeated so multiplicities are exercised) and every stage of
+generate_results is timed on its own:
+
+    parse        parse_int_array over the five list texts
+    enumerate    iter_candidate_blocks (candidates + validation)
+    bins         BinIndex.bins_batch and the used-exactly-k filter
+    sort         rank_keys + np.lexsort
+    dataframe    result_table and the df_with_inter frame
+    total        generate_results end to end
+    xlsx_valid   valid_workbook_bytes
+    xlsx_color   color_workbook_bytes
+    csv, csv_gz, parquet, arrow
+                 write_data_export (Parquet and Arrow only with pyarrow)
+
+Each stage reports the best of --repeat runs. --json stores the results,
+and --compare prints the ratio against an earlier --json file.
+
+    python benchmarks/bench_stages.py --sizes 100 1000 5000 --json before.json
+    python benchmarks/bench_stages.py --sizes 100 1000 5000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from combinations_core import (  # noqa: E402
+    COMBINATION_RULES,
+    DATA_EXPORTS,
+    BinIndex,
+    ExclusionIndex,
+    color_workbook_bytes,
+    generate_results,
+    iter_candidate_blocks,
+    parse_int_array,
+    pyarrow_available,
+    rank_keys,
+    result_table,
+    valid_workbook_bytes,
+    write_data_export,
+)
+
+METHODS = ('single', 'dual', 'double_single', 'double_dual', 'double')
+STAGES = ('parse', 'enumerate', 'bins', 'sort', 'dataframe', 'total', 'xlsx_valid', 'xlsx_color',
+          'csv', 'csv_gz', 'parquet', 'arrow')
+TOGGLES = (True, False, False, False, False)  # the page defaults
+
+
+def make_lists(size, spread, dup, X1, seed):
+    """Texts of the four lists and the Not Wanted List, as pasted into the page."""
+    rnd = random.Random(seed)
+    high = max(size * spread, 10)
+    texts = []
+    for length in (size, size // 3, size // 2, size // 5, size):
+        values = [rnd.randint(1, high) for _ in range(length)]
+        values += values[: int(len(values) * dup)]
+        texts.append(",".join(map(str, values)))
+    # Gen = X1 + 1 has to be in the lists for the dual modes to produce anything
+    texts[0] += f",{X1 + 1}"
+    return texts
+
+
+def best_of(repeat, fn):
+    """(best wall time, last return value) over repeat calls."""
+    best, value = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+
+def bench_method(method, texts, X1, X2, repeat, xlsx_max_rows):
+    timings = {}
+    timings['parse'], parsed = best_of(repeat, lambda: [parse_int_array(text)[0].tolist() for text in texts])
+    Main, G, R, C_list, not_wanted = parsed
+    counts = Counter(Main + G + R + C_list)
+    nwis = ExclusionIndex(not_wanted)
+    bin_index = BinIndex(Main, G, R, C_list)
+    width = COMBINATION_RULES[method].width
+
+    def enumerate_all():
+        blocks = [block for block, _ in iter_candidate_blocks(method, counts, nwis, X1, X2, *TOGGLES)]
+        return np.concatenate([np.empty((0, width), dtype=np.int64)] + blocks)
+    timings['enumerate'], candidates = best_of(repeat, enumerate_all)
+
+    def bin_and_filter():
+        bins = bin_index.bins_batch(candidates)
+        keep = bins.sum(axis=1) == width
+        return candidates[keep], bins[keep]
+    timings['bins'], (tuples, bins) = best_of(repeat, bin_and_filter)
+
+    timings['sort'], order = best_of(repeat, lambda: np.lexsort(rank_keys(method, tuples, bins).T[::-1]))
+    tuples, bins = tuples[order], bins[order]
+
+    def build_frame():
+        values, columns = result_table(method, X1, X2, tuples, bins)
+        return pd.DataFrame(values, columns=columns, copy=False)
+    timings['dataframe'], _ = best_of(repeat, build_frame)
+
+    timings['total'], result = best_of(repeat, lambda: generate_results(
+        method, X1, X2, *TOGGLES, Main, G, R, C_list, not_wanted))
+    df_with_inter = result['df_with_inter']
+    if len(df_with_inter) <= xlsx_max_rows:
+        timings['xlsx_valid'], _ = best_of(repeat, lambda: valid_workbook_bytes(df_with_inter))
+        timings['xlsx_color'], _ = best_of(repeat, lambda: color_workbook_bytes(method, X1, X2, df_with_inter))
+    for kind in DATA_EXPORTS:
+        if kind in ('parquet', 'arrow') and not pyarrow_available():
+            continue
+        timings[kind], _ = best_of(repeat, lambda: write_data_export(df_with_inter, kind, BytesIO()))
+    return {'candidates': len(candidates), 'rows': len(df_with_inter), 'stages': timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="length of the Priority and Not Wanted lists (the others are a fraction of it)")
+    parser.add_argument("--spread", type=int, default=4, help="values are drawn from [1, size * spread]")
+    parser.add_argument("--dup", type=float, default=0.1, help="fraction of each list repeated")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--X1", type=int, default=5)
+    parser.add_argument("--X2", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--xlsx-max-rows", type=int, default=20000, help="skip the xlsx writers above this")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="earlier --json file to compare against")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            for run in json.load(f)['runs']:
+                baseline[run['method'], run['size']] = run['stages']
+
+    print(f"{'method':<14}{'size':>7}{'cands':>9}{'rows':>8}" + "".join(f"{stage:>11}" for stage in STAGES))
+    runs = []
+    for size in args.sizes:
+        texts = make_lists(size, args.spread, args.dup, args.X1, args.seed)
+        for method in args.methods:
+            run = {'method': method, 'size': size,
+                   **bench_method(method, texts, args.X1, args.X2, args.repeat, args.xlsx_max_rows)}
+            runs.append(run)
+            cells = []
+            for stage in STAGES:
+                seconds = run['stages'].get(stage)
+                before = baseline.get((method, size), {}).get(stage)
+                if seconds is None:
+                    cells.append(f"{'-':>11}")
+                elif before:
+                    cells.append(f"{before / max(seconds, 1e-9):>10.2f}x")
+                else:
+                    cells.append(f"{seconds:>11.4f}")
+            print(f"{method:<14}{size:>7}{run['candidates']:>9}{run['rows']:>8}" + "".join(cells))
+    if baseline:
+        print("(ratios are earlier time / current time, > 1 is faster)")
+
+    if args.json:
+        meta = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'args': vars(args),
+        }
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'runs': runs}, f, indent=2)
+        print(f"results -> {args.json}")
+
+
+if __name__ == "__main__":
+    main()
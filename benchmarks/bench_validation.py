@@ -0,0 +1,69 @@
+"""
+Benchmark: the multiplicity check on batches of candidate tuples.
+
+Times three ways of checking that every number of a tuple has enough
+copies in the lists: has_copies called per tuple (what the is_valid_*
+helpers do), the (n, k, k) broadcast the enumeration used before, and the
+column-wise has_enough_counts kernel. All three must agree.
+
+    python benchmarks/bench_validation.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from combinations_core import counts_lookup_table, has_copies, has_enough_counts, lookup_counts  # noqa: E402
+
+
+def broadcast_check(candidates, table):
+    """The (n, k, k) equality broadcast has_enough_counts used before, kept as the reference."""
+    required = (candidates[:, :, None] == candidates[:, None, :]).sum(axis=2)
+    available = lookup_counts(candidates, table)
+    return (available >= required).all(axis=1)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--width", type=int, default=5, help="values per tuple (5 for triples, 2 for doubles)")
+    parser.add_argument("--values", type=int, default=300, help="tuple values are drawn from [1, values]")
+    parser.add_argument("--list-size", type=int, default=1000, help="numbers in the four lists together")
+    parser.add_argument("--scalar-max", type=int, default=100_000, help="largest batch timed with has_copies")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    counts = Counter(rng.integers(1, args.values + 1, size=args.list_size).tolist())
+    table = counts_lookup_table(counts)
+
+    print(f"{'rows':>9}{'scalar s':>11}{'broadcast s':>13}{'kernel s':>10}{'speedup':>9}{'pass':>9}")
+    for rows in args.rows:
+        candidates = rng.integers(1, args.values + 1, size=(rows, args.width))
+        broadcast_s, expected = timed(broadcast_check, candidates, table)
+        kernel_s, mask = timed(has_enough_counts, candidates, table)
+        assert (mask == expected).all(), "kernel and broadcast disagree"
+
+        scalar = "-"
+        if rows <= args.scalar_max:
+            tuples = [tuple(row) for row in candidates.tolist()]
+            scalar_s, scalar_mask = timed(lambda: [has_copies(row, counts) for row in tuples])
+            assert scalar_mask == mask.tolist(), "kernel and has_copies disagree"
+            scalar = f"{scalar_s:.4f}"
+        speedup = f"{broadcast_s / max(kernel_s, 1e-9):.1f}x"
+        print(f"{rows:>9}{scalar:>11}{broadcast_s:>13.4f}{kernel_s:>10.4f}{speedup:>9}{int(mask.sum()):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Load test for server.py: latency percentiles and throughput of /combinations.
+
+--concurrency clients each keep one connection open and send requests
+back to back until --requests have been made. The jobs cycle through
+--distinct variants of the page defaults (each drops a different entry of
+the Not Wanted List), so after the first round most requests are cache
+hits. Use --distinct equal to --requests to measure cold runs only.
+
+    python server.py --port 8765 &
+    python benchmarks/load_test.py --port 8765 --requests 500 --concurrency 16
+
+    # start (and stop) a server on a free port for the run
+    python benchmarks/load_test.py --start-server --workers 2 --method dual --top-k 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from combinations_core import DEFAULT_NWIM, parse_list  # noqa: E402
+
+
+def make_jobs(method, top_k, distinct):
+    not_wanted = parse_list(DEFAULT_NWIM)
+    jobs = []
+    for i in range(distinct):
+        variant = not_wanted[:i % len(not_wanted)] + not_wanted[i % len(not_wanted) + 1:]
+        if i >= len(not_wanted):
+            variant = variant[:-(i // len(not_wanted))]
+        jobs.append({'method': method, 'top_k': top_k, 'not_wanted': variant})
+    return jobs
+
+
+async def read_response(reader):
+    """(status, body bytes) of one response, with Content-Length or chunked framing."""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).strip(), 16)
+            if size == 0:
+                await reader.readuntil(b'\r\n')
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        return status, bytes(body)
+    return status, await reader.readexactly(int(headers.get('content-length', 0)))
+
+
+async def client(host, port, fmt, jobs, counter, results):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while True:
+            n = next(counter, None)
+            if n is None:
+                return
+            body = json.dumps(jobs[n % len(jobs)]).encode()
+            request = (f"POST /combinations?format={fmt} HTTP/1.1\r\nHost: {host}\r\n"
+                       f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, data = await read_response(reader)
+            results.append((time.perf_counter() - start, status, len(data)))
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, fmt, jobs, requests, concurrency):
+    counter = iter(range(requests))
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, fmt, jobs, counter, results) for _ in range(concurrency)])
+    return time.perf_counter() - start, results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers):
+    command = [sys.executable, os.path.join(ROOT, 'server.py'), '--port', str(port)]
+    if workers:
+        command += ['--workers', str(workers)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()  # "serving on ..." once the workers are up
+    if not line.startswith('serving'):
+        process.kill()
+        sys.exit("server.py did not start")
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--start-server", dest="start_server", action="store_true",
+                        help="run server.py on a free port for the duration of the test")
+    parser.add_argument("--workers", type=int, help="--workers of the started server")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=10, help="distinct jobs the requests cycle through")
+    parser.add_argument("--method", default="dual")
+    parser.add_argument("--top-k", dest="top_k", type=int, default=0)
+    parser.add_argument("--format", dest="fmt", choices=('json', 'ndjson', 'csv'), default='json')
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    process = None
+    if args.start_server:
+        args.port = free_port()
+        process = start_server(args.port, args.workers)
+    try:
+        jobs = make_jobs(args.method, args.top_k, args.distinct)
+        elapsed, results = asyncio.run(
+            run_load(args.host, args.port, args.fmt, jobs, args.requests, args.concurrency))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies = np.array([seconds for seconds, _, _ in results]) * 1000
+    statuses = Counter(status for _, status, _ in results)
+    summary = {
+        'requests': len(results),
+        'concurrency': args.concurrency,
+        'distinct_jobs': len(jobs),
+        'method': args.method,
+        'format': args.fmt,
+        'seconds': elapsed,
+        'requests_per_s': len(results) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'mean_kb': float(np.mean([size for _, _, size in results]) / 1024),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+    }
+    print(f"{summary['requests']} requests, {args.concurrency} connections, {len(jobs)} distinct jobs "
+          f"({args.method}, {args.fmt}) in {elapsed:.2f}s")
+    print(f"  {summary['requests_per_s']:.1f} req/s   p50 {summary['p50_ms']:.1f} ms   "
+          f"p90 {summary['p90_ms']:.1f} ms   p99 {summary['p99_ms']:.1f} ms   max {summary['max_ms']:.1f} ms")
+    print(f"  {summary['mean_kb']:.1f} KiB per response   statuses {summary['statuses']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"results -> {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Headless runner for the Number Combinations Generator.
+
+Runs the same pipeline as the Streamlit page without importing Streamlit
+and writes the downloads to disk.
+
+    # one run from flags (lists default to the ones shown in the app)
+    python cli.py --method dual --X1 5 --X2 15 --strict-total --out results/
+
+    # only the 100 best ranked rows, without building the full result
+    python cli.py --method double_dual --top-k 100 --out results/
+
+    # one run from a JSON/YAML job file
+    python cli.py --job job.yaml --out results/
+
+    # many runs in one process
+    python cli.py --jobs jobs.json --out results/ --formats xlsx csv
+
+    # large runs: gzip'd CSV and Parquet (Parquet/Arrow need pyarrow)
+    python cli.py --method dual --formats csv_gz parquet --out results/
+
+    # parameter sweep over X1/X2 and all 32 toggle combinations on 32 cores
+    python cli.py --sweep --X1-values 1:10 --X2-values 10:20 --toggle-grid --workers 32 --out sweep/
+
+A job is a mapping with the same names as the flags, e.g.
+
+    {"name": "dual-x7", "method": "dual", "X1": 7, "X2": 15,
+     "priority": "1,3,5,11", "not_wanted": [2, 4, 9],
+     "strict_main_sub": true, "strict_total": true}
+
+A --jobs file holds a list of jobs, or {"defaults": {...}, "jobs": [...]}
+where each job is layered over the defaults.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from combinations_core import (
+    CANDIDATE_CACHE_SIZE,
+    DATA_EXPORTS,
+    ENUMERATORS,
+    JOB_DEFAULTS,
+    LIST_FIELDS,
+    TOGGLE_FIELDS,
+    BinIndex,
+    ExclusionIndex,
+    ResultCache,
+    count_valid_rows,
+    export_bytes,
+    export_filename,
+    normalize_job,
+    parse_list,
+    run_job,
+    write_data_export,
+)
+
+FORMATS = ('xlsx', 'color', 'csv', 'csv_gz', 'parquet', 'arrow')
+# The four combinations offered in the Streamlit page
+SWEEP_METHODS = ('single', 'dual', 'double_single', 'double_dual')
+
+
+def load_job_file(path):
+    """Read a JSON or YAML (.yaml/.yml, needs PyYAML) job file."""
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                sys.exit("Reading YAML job files needs PyYAML (pip install pyyaml)")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def checked_job(job, defaults=JOB_DEFAULTS):
+    """normalize_job, exiting with its message instead of a traceback for an invalid job."""
+    try:
+        return normalize_job(job, defaults)
+    except (TypeError, ValueError) as exc:
+        sys.exit(f"error: {exc}")
+
+
+def write_outputs(result, out_dir, formats):
+    """Write the requested formats for a result into out_dir; returns the paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    if 'xlsx' in formats:
+        paths.append(os.path.join(out_dir, result['filenames']['valid']))
+        with open(paths[-1], 'wb') as f:
+            f.write(export_bytes(result, 'valid'))
+    if 'color' in formats:
+        paths.append(os.path.join(out_dir, result['filenames']['color']))
+        with open(paths[-1], 'wb') as f:
+            f.write(export_bytes(result, 'color'))
+    for kind in DATA_EXPORTS:
+        if kind in formats:
+            # Written straight to the file rather than through export_bytes
+            paths.append(os.path.join(out_dir, export_filename(result, kind)))
+            with open(paths[-1], 'wb') as f:
+                write_data_export(result['df_with_inter'], kind, f)
+    return paths
+
+
+def parse_values(spec):
+    """Integer values from '5', '1,3,7' or an inclusive range 'start:stop[:step]'."""
+    if ':' in spec:
+        parts = [int(x) for x in spec.split(':')]
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) > 2 else 1
+        return list(range(start, stop + (1 if step > 0 else -1), step))
+    return parse_list(spec)
+
+
+def sweep_configs(methods, X1_values, X2_values, toggle_sets):
+    """Every (method, X1, X2, toggles) combination of the sweep."""
+    return list(itertools.product(methods, X1_values, X2_values, toggle_sets))
+
+
+# Per-process state of a sweep worker: everything that only depends on the lists
+_sweep_state = {}
+
+
+def _init_sweep_worker(Main, G, R, C_list, not_wanted_in_sum):
+    _sweep_state['counts'] = Counter(Main + G + R + C_list)
+    _sweep_state['nwis'] = ExclusionIndex(not_wanted_in_sum)
+    _sweep_state['bin_index'] = BinIndex(Main, G, R, C_list)
+
+
+def _sweep_one(config):
+    method, X1, X2, toggles = config
+    return count_valid_rows(method, X1, X2, toggles, **_sweep_state)
+
+
+def run_sweep(configs, lists, workers=None):
+    """
+    Count the valid rows of every configuration, spread over a process pool.
+    The lists are sent to each worker once (initializer) and the
+    configurations in chunks, so per-task overhead stays small.
+    Returns a summary frame with one row per configuration.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(configs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                             initargs=tuple(lists)) as pool:
+        valid_rows = list(pool.map(_sweep_one, configs, chunksize=chunksize))
+
+    rows = [[method, X1, X2, *toggles, n]
+            for (method, X1, X2, toggles), n in zip(configs, valid_rows)]
+    return pd.DataFrame(rows, columns=['method', 'X1', 'X2', *TOGGLE_FIELDS, 'valid_rows'])
+
+
+def non_negative_int(text):
+    """argparse type for --top-k."""
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {value}")
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--job", help="JSON/YAML file with a single job")
+    source.add_argument("--jobs", help="JSON/YAML file with a list of jobs")
+
+    parser.add_argument("--method", choices=sorted(ENUMERATORS))
+    parser.add_argument("--X1", type=int)
+    parser.add_argument("--X2", type=int)
+    parser.add_argument("--top-k", dest="top_k", type=non_negative_int,
+                        help="keep only the K best ranked rows (0 = all)")
+    for field in LIST_FIELDS:
+        parser.add_argument(f"--{field.replace('_', '-')}", dest=field,
+                            help="comma-separated integers")
+    for field in TOGGLE_FIELDS:
+        parser.add_argument(f"--{field.replace('_', '-')}", dest=field,
+                            action=argparse.BooleanOptionalAction, default=None)
+
+    parser.add_argument("--out", default=".", help="output directory (default: current)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=['xlsx', 'color'])
+
+    sweep = parser.add_argument_group("sweep", "count valid rows over a grid of parameters")
+    sweep.add_argument("--sweep", action="store_true", help="run a parameter sweep instead of jobs")
+    sweep.add_argument("--methods", nargs="+", choices=sorted(ENUMERATORS), default=list(SWEEP_METHODS))
+    sweep.add_argument("--X1-values", dest="X1_values", help="e.g. 5, 1,3,7 or 1:10")
+    sweep.add_argument("--X2-values", dest="X2_values", help="e.g. 15, 10,15 or 10:20")
+    sweep.add_argument("--toggle-grid", action="store_true",
+                       help="sweep all 32 combinations of the five strict toggles")
+    sweep.add_argument("--workers", type=int, help="processes (default: all cores)")
+    return parser
+
+
+def main_sweep(args, overrides):
+    base = checked_job({**(load_job_file(args.job) if args.job else {}), **overrides})
+    X1_values = parse_values(args.X1_values) if args.X1_values else [base['X1']]
+    X2_values = parse_values(args.X2_values) if args.X2_values else [base['X2']]
+    if args.toggle_grid:
+        toggle_sets = list(itertools.product([False, True], repeat=len(TOGGLE_FIELDS)))
+    else:
+        toggle_sets = [tuple(base[field] for field in TOGGLE_FIELDS)]
+
+    configs = sweep_configs(args.methods, X1_values, X2_values, toggle_sets)
+    lists = [base[field] for field in LIST_FIELDS]
+    start = time.perf_counter()
+    summary = run_sweep(configs, lists, args.workers)
+    elapsed = time.perf_counter() - start
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, "sweep_summary.csv")
+    summary.to_csv(path, index=False)
+    per_method = summary.groupby('method')['valid_rows'].agg(configs='size', total='sum', max='max')
+    print(per_method.to_string())
+    print(f"{len(configs)} configurations in {elapsed:.2f}s -> {path}")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # Flags given on the command line override the job file(s)
+    overrides = {name: value for name, value in vars(args).items()
+                 if name in JOB_DEFAULTS and value is not None}
+    if args.sweep:
+        return main_sweep(args, overrides)
+
+    if args.jobs:
+        data = load_job_file(args.jobs)
+        defaults, jobs = JOB_DEFAULTS, data
+        if isinstance(data, dict):
+            defaults = {**JOB_DEFAULTS, **data.get('defaults', {})}
+            jobs = data['jobs']
+    else:
+        defaults = JOB_DEFAULTS
+        jobs = [load_job_file(args.job) if args.job else {}]
+
+    cache = ResultCache()
+    # Building the unfiltered candidates only pays off when later jobs can re-filter them
+    candidate_cache = ResultCache(CANDIDATE_CACHE_SIZE) if len(jobs) > 1 else None
+    for n, job in enumerate(jobs, 1):
+        job = checked_job({**job, **overrides}, defaults)
+        name = job.get('name') or (f"job-{n}" if args.jobs else "")
+        start = time.perf_counter()
+        result = run_job(job, cache, candidate_cache)
+        paths = write_outputs(result, os.path.join(args.out, name), args.formats)
+        elapsed = time.perf_counter() - start
+        label = name or job['method']
+        print(f"{label}: {len(result['df_with_inter'])} valid rows in {elapsed:.2f}s -> {', '.join(paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1761 @@
+"""
+Core of the Number Combinations Generator: parsing, enumeration, ranking
+and export. Shared by the Streamlit page (app.py) and the CLI (cli.py);
+nothing in here depends on Streamlit.
+"""
+import pandas as pd
+import numpy as np
+import gzip
+import heapq
+import importlib.util
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+from io import BytesIO
+
+# Only import openpyxl if we do color-coding
+# (We will conditionally import it later if needed)
+
+# Default lists shown in the Streamlit page and used by the CLI
+DEFAULT_MAIN = "1,3,5,11,13,15,16,21,23,24,25,29,31,32,33,35,37,39,41,45,47,48,52,57,65,67,68,82"
+DEFAULT_G = "15,16,23,24,32,33,41"
+DEFAULT_R = "3,5,6,11,13,15,16,24,31,32,35"
+DEFAULT_C_LIST = "6,7,17,18,38,51,55,61,75"
+DEFAULT_NWIM = "2,4,9,10,12,14,19,20,22,26,27,28,30,34,36,40,42,43,44,46,49,50,53,54,56,58,59,60,62,64,66,69,70,72,73,74,76,78,79,80"
+
+# Integers may be separated by commas, semicolons, spaces, tabs or newlines
+LIST_SEPARATORS = str.maketrans(',;', '  ')
+# Bytes allowed in a well-formed list: digits, '-', separators and whitespace
+_LIST_BYTES = np.zeros(256, dtype=bool)
+_LIST_BYTES[np.frombuffer(b'0123456789-,; \t\n\r\x0b\x0c', dtype=np.uint8)] = True
+_SEPARATOR_BYTES = np.zeros(256, dtype=bool)
+_SEPARATOR_BYTES[np.frombuffer(b',; \t\n\r\x0b\x0c', dtype=np.uint8)] = True
+_DIGIT_BYTES = np.zeros(256, dtype=bool)
+_DIGIT_BYTES[np.frombuffer(b'0123456789', dtype=np.uint8)] = True
+# Largest magnitude of a list value (and of X1/X2 in a job): exact as a JSON
+# number, and the sums the rules build from a few of them stay in int64
+LIST_VALUE_LIMIT = 2**53
+# A token that is not an integer of at most 16 digits, the length of LIST_VALUE_LIMIT
+# (only used once a list is known to be malformed)
+_MALFORMED_TOKEN = re.compile(r'(?<![^\s,;])(?!-?0*\d{1,16}(?![^\s,;]))[^\s,;]+', re.ASCII)
+LIST_FILE_TYPES = ('csv', 'txt', 'xlsx')
+
+def _is_well_formed(data):
+    """True if the bytes only hold integers and separators, checked with table lookups."""
+    chars = np.frombuffer(data, dtype=np.uint8)
+    if not _LIST_BYTES[chars].all():
+        return False
+    # '-' must start a number: preceded by a separator (or the start) and followed by a digit
+    minus = np.flatnonzero(chars == ord('-'))
+    if len(minus):
+        after = minus + 1
+        if after[-1] == len(chars) or not _DIGIT_BYTES[chars[after]].all():
+            return False
+        before = minus[minus > 0] - 1
+        if not _SEPARATOR_BYTES[chars[before]].all():
+            return False
+    return True
+
+def parse_int_array(input_str):
+    """
+    Parse a list of integers separated by commas, semicolons or whitespace.
+    Returns (values, malformed): the integers as a compact array (int32 when
+    they fit, else int64) and the tokens that were not integers within
+    +/- LIST_VALUE_LIMIT, which are skipped. Well-formed input is checked
+    and converted in NumPy without a per-token Python loop; only malformed
+    input goes through a regex pass.
+    """
+    text = input_str
+    values, malformed = None, []
+    if _is_well_formed(text.encode('utf-8')):
+        values = _to_int_array(text)
+        if _out_of_range(values).any():
+            values = None  # too large, possibly saturated at the int64 limits
+    if values is None:
+        malformed = _MALFORMED_TOKEN.findall(text)
+        values = _to_int_array(_MALFORMED_TOKEN.sub(' ', text))
+        outside = _out_of_range(values)
+        if outside.any():
+            # 16-digit numbers beyond the limit, listed after the other malformed tokens
+            malformed += [str(value) for value in values[outside].tolist()]
+            values = values[~outside]
+    return compact_ints(values), malformed
+
+def _out_of_range(values):
+    return (values < -LIST_VALUE_LIMIT) | (values > LIST_VALUE_LIMIT)
+
+def compact_ints(values):
+    """values as int32 when every value fits, else as int64."""
+    info = np.iinfo(np.int32)
+    if not len(values) or (values.min() >= info.min and values.max() <= info.max):
+        return values.astype(np.int32, copy=False)
+    return values.astype(np.int64, copy=False)
+
+def _to_int_array(text):
+    text = text.translate(LIST_SEPARATORS).strip()
+    if not text:
+        return np.empty(0, dtype=np.int64)
+    return np.fromstring(text, dtype=np.int64, sep=' ')
+
+def parse_list(input_str):
+    """Helper to parse a comma-separated string of integers (malformed tokens are skipped)."""
+    return parse_int_array(input_str)[0].tolist()
+
+def read_list_file(name, data):
+    """
+    parse_int_array for an uploaded list file: .xlsx (every non-empty cell
+    of the first sheet) or CSV/text in any of the separators above.
+    """
+    if name.lower().endswith('.xlsx'):
+        cells = pd.read_excel(BytesIO(data), header=None, dtype=str).to_numpy().ravel()
+        return parse_int_array(' '.join(cells[pd.notna(cells)]))
+    return parse_int_array(data.decode('utf-8-sig', errors='replace'))
+
+class ExclusionIndex:
+    """
+    Index over the Not Wanted List.
+    Scalar `x in nwis` checks hit a frozenset, and the vectorized paths use
+    mask() which looks values up in a dense bitmap over [lo, hi].
+    """
+    # Beyond this span the bitmap would waste memory, so fall back to a sorted array
+    MAX_BITMAP_SPAN = 1 << 24
+
+    def __init__(self, values):
+        self.values = frozenset(values)
+        self.sorted_values = np.array(sorted(self.values), dtype=np.int64)
+        self.bitmap = None
+        self.lo = 0
+        if len(self.sorted_values):
+            self.lo = int(self.sorted_values[0])
+            span = int(self.sorted_values[-1]) - self.lo + 1
+            if span <= self.MAX_BITMAP_SPAN:
+                self.bitmap = np.zeros(span, dtype=bool)
+                self.bitmap[self.sorted_values - self.lo] = True
+
+    def __contains__(self, num):
+        return num in self.values
+
+    def __iter__(self):
+        return iter(self.sorted_values.tolist())
+
+    def __len__(self):
+        return len(self.values)
+
+    def mask(self, values):
+        """Vectorized membership test: True where the value is in the Not Wanted List."""
+        values = np.asarray(values, dtype=np.int64)
+        if not len(self.sorted_values):
+            return np.zeros(values.shape, dtype=bool)
+        if self.bitmap is not None:
+            idx = values - self.lo
+            inside = (idx >= 0) & (idx < len(self.bitmap))
+            return inside & self.bitmap[np.clip(idx, 0, len(self.bitmap) - 1)]
+        pos = np.searchsorted(self.sorted_values, values)
+        pos = np.clip(pos, 0, len(self.sorted_values) - 1)
+        return self.sorted_values[pos] == values
+
+def remove_nwis(sample_list, nwis):
+    """Remove any items from sample_list that appear in nwis."""
+    return [x for x in sample_list if x not in nwis]
+
+def has_copies(values, counts):
+    """
+    Scalar multiplicity check for one tuple: every number in values occurs
+    at least as many times in counts as it does in values. has_enough_counts
+    is the same rule for a whole batch.
+    """
+    for num in values:
+        if counts.get(num, 0) < values.count(num):
+            return False
+    return True
+
+def is_valid_triple(A, B, C, counts, strict_switch, nwis):
+    """
+    Check if the triple (A, B, C) can be formed with available counts.
+    If strict_switch is True, apply extra checks involving nwis.
+    """
+    # If strict_switch is on, apply extra NWIS logic
+    if strict_switch:
+        if (B - 5) in nwis:
+            return False
+        if (C - B + 5) in nwis:
+            return False
+
+    # Check we have enough occurrences for each number
+    return has_copies((A, B, C), counts)
+
+def is_valid_triple_single(M, S, T, Ext, Gen, counts, strict_switch, nwis):
+    """
+    Check if the triple (A, B, C) can be formed with available counts.
+    If strict_switch is True, apply extra checks involving nwis.
+    """
+    # If strict_switch is on, apply extra NWIS logic
+    if strict_switch:
+        if (M - 5) in nwis:
+            return False
+
+    # Check we have enough occurrences for each number
+    return has_copies((M, S, T, Ext, Gen), counts)
+
+def is_valid_triple_dual(M, S, T, Ext, Gen, counts, strict_switch, nwis):
+    """
+    Check if the triple (A, B, C) can be formed with available counts.
+    If strict_switch is True, apply extra checks involving nwis.
+    """
+    # If strict_switch is on, apply extra NWIS logic
+    if strict_switch:
+        if (M - 5) in nwis:
+            return False
+        if (S-M+5) in nwis:
+            return False
+
+    # Check we have enough occurrences for each number
+    return has_copies((M, S, T, Ext, Gen), counts)
+
+def is_valid_triple_double_dual(M, S, T, Ext, Gen, counts, strict_switch, nwis):
+    """
+    Check if the triple (A, B, C) can be formed with available counts.
+    If strict_switch is True, apply extra checks involving nwis.
+    """
+    # If strict_switch is on, apply extra NWIS logic
+    if strict_switch:
+        if (M - 15) in nwis:
+            return False
+        if (S - M + 15) in nwis:
+            return False
+
+    # Check we have enough occurrences for each number
+    return has_copies((M, S, T, Ext, Gen), counts)
+
+def is_valid_triple_double_single(M, S, T, Ext, Gen, counts, strict_switch, nwis):
+    """
+    Check if the triple (A, B, C) can be formed with available counts.
+    If strict_switch is True, apply extra checks involving nwis.
+    """
+    # If strict_switch is on, apply extra NWIS logic
+    if strict_switch:
+        if (S - 1) in nwis:
+            return False
+
+    # Check we have enough occurrences for each number
+    return has_copies((M, S, T, Ext, Gen), counts)
+
+def is_valid_double(A, B, counts, strict_switch, nwis):
+    """
+    Check if the double (A, B) can be formed with available counts.
+    If strict_switch is True, apply extra checks involving nwis.
+    """
+    # If strict_switch is on, apply extra NWIS logic
+    if strict_switch:
+        if (B - 1) in nwis:
+            return False
+
+    # Check we have enough occurrences for each number
+    return has_copies((A, B), counts)
+
+class ValueTable:
+    """
+    Rows of numbers keyed by integer values, looked up for whole arrays of
+    values at once; values that are not keys read as zero rows. It is a
+    dense array over [lo, hi] while that is cheap: at most
+    DENSE_SLOTS_PER_KEY slots per key (or MIN_DENSE_SLOTS) and at most
+    MAX_DENSE_BYTES in all. Sparse or wide key sets keep the sorted keys
+    instead, searched with np.searchsorted.
+    """
+    DENSE_SLOTS_PER_KEY = 64
+    MIN_DENSE_SLOTS = 4096
+    MAX_DENSE_BYTES = 32 * 2**20
+
+    def __init__(self, keys, rows):
+        keys = np.asarray(keys, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.rows = keys[order], rows[order]
+        self.dense = None
+        self.lo = 0
+        if len(self.keys):
+            self.lo = int(self.keys[0])
+            span = int(self.keys[-1]) - self.lo + 1
+            slot_bytes = self.rows[0].nbytes
+            if (span <= max(self.DENSE_SLOTS_PER_KEY * len(self.keys), self.MIN_DENSE_SLOTS)
+                    and span * slot_bytes <= self.MAX_DENSE_BYTES):
+                self.dense = np.zeros((span,) + self.rows.shape[1:], dtype=np.int64)
+                self.dense[self.keys - self.lo] = self.rows
+
+    def take(self, values):
+        """The row of every value in an int array (zeros for values that are not keys)."""
+        values = np.asarray(values, dtype=np.int64)
+        if not len(self.keys):
+            return np.zeros(values.shape + self.rows.shape[1:], dtype=np.int64)
+        if self.dense is not None:
+            idx = values - self.lo
+            outside = (idx < 0) | (idx >= len(self.dense))
+            found = self.dense.take(idx, axis=0, mode='clip')
+        else:
+            pos = np.searchsorted(self.keys, values).clip(0, len(self.keys) - 1)
+            outside = self.keys[pos] != values
+            found = self.rows.take(pos, axis=0)
+        found[outside] = 0
+        return found
+
+def counts_lookup_table(counts):
+    """
+    A ValueTable of the counts dict, so multiplicities can be read for
+    whole arrays of values at once (see lookup_counts).
+    """
+    keys = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    return ValueTable(keys, values)
+
+def lookup_counts(values, table):
+    """Vectorized counts.get(v, 0) for an array of values."""
+    return table.take(values)
+
+def occurrence_ranks(columns):
+    """
+    Occurrence rank of every cell of a batch of tuples given column by
+    column (a (k, n) array or a list of k arrays): how many earlier columns
+    of the same row hold the same number, so the r-th copy of a number in
+    a row has rank r - 1. Returns a list of k int arrays.
+    Works on whole columns, k * (k - 1) / 2 comparisons of n values each.
+    """
+    ranks = []
+    for j, column in enumerate(columns):
+        rank = np.zeros(len(column), dtype=np.int64)
+        for earlier in columns[:j]:
+            rank += earlier == column
+        ranks.append(rank)
+    return ranks
+
+def enough_counts_mask(columns, table):
+    """
+    The multiplicity check on a batch given column by column, see
+    has_enough_counts. A row passes when every cell's occurrence rank is
+    below the count of its number: the r-th copy needs at least r copies.
+    """
+    ok = np.ones(len(columns[0]) if len(columns) else 0, dtype=bool)
+    for column, rank in zip(columns, occurrence_ranks(columns)):
+        ok &= lookup_counts(column, table) > rank
+    return ok
+
+def has_enough_counts(candidates, table):
+    """
+    Vectorized multiplicity check for an (n, k) int array of candidate
+    tuples, against the counts table of counts_lookup_table. A row
+    passes when every number in it occurs at least as many times in the
+    counts as it does in the row (the rule of has_copies and the is_valid_*
+    helpers). Returns a boolean mask of the rows.
+    """
+    candidates = np.asarray(candidates, dtype=np.int64).reshape(len(candidates), -1)
+    return enough_counts_mask(np.ascontiguousarray(candidates.T), table)
+
+# Pairs in the first block of a two-variable search; later blocks double up to chunk_size
+FIRST_BLOCK_SIZE = 16_384
+
+# Positions in the toggles tuple (toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E)
+TOGGLE_M_S, STRICT_SWITCH, TOGGLE_T, TOGGLE_G, TOGGLE_E = range(5)
+NO_TOGGLES = (False, False, False, False, False)
+
+class _Field:
+    """
+    Placeholder for a per-result value (a result column) in the block-row
+    templates of build_formatted and color_workbook_bytes.
+    """
+    def __init__(self, name):
+        self.name = name
+
+BIN_COLUMNS = ['Priority_count', '2nd_count', '3rd_count', 'Backup_count']
+TUPLE_COLUMNS = ['Main', 'Subsidary', 'Total', 'Ext', 'Gen']
+
+# ---------------------------------------------------------------
+# Combination rules.
+# Every combination type is a CombinationRule written as linear
+# expressions ('S - M + X1 + 1'). A rule is compiled once per (X1, X2)
+# into forms {name: coefficient, 1: constant} over its free variables,
+# and iter_candidate_blocks evaluates those on whole arrays.
+# ---------------------------------------------------------------
+_LINEAR_TERM = re.compile(r'\s*([+-]?)\s*(?:(\d+)\s*\*\s*)?([A-Za-z_]\w*|\d+)\s*')
+_COMPARISON = re.compile(r'^(.+?)(>=|<=|>|<)(.+)$')
+
+def linear_form(expr, env):
+    """
+    Parse a sum of integers, names and integer * name terms, such as
+    'S - M + X1 + 1' or '2 * M', into a form {name: coefficient, 1: constant}.
+    Names are looked up in env (name -> form) and substituted.
+    """
+    form = {1: 0}
+    pos, expr = 0, expr.strip()
+    if not expr:
+        raise ValueError("empty expression")
+    while pos < len(expr):
+        match = _LINEAR_TERM.match(expr, pos)
+        if match is None or (pos and not match.group(1)):
+            raise ValueError(f"not a linear expression: {expr!r}")
+        sign, weight, atom = match.groups()
+        if not atom.isdigit() and atom not in env:
+            raise ValueError(f"unknown name {atom!r} in {expr!r}")
+        scale = (-1 if sign == '-' else 1) * int(weight or 1)
+        for name, coeff in ({1: int(atom)} if atom.isdigit() else env[atom]).items():
+            form[name] = form.get(name, 0) + scale * coeff
+        pos = match.end()
+    return {name: coeff for name, coeff in form.items() if coeff or name == 1}
+
+def comparison_form(condition, env):
+    """'lhs > rhs' (or >=, <, <=) as a form that is >= 0 exactly when the condition holds."""
+    match = _COMPARISON.match(condition.strip())
+    if match is None:
+        raise ValueError(f"not a comparison: {condition!r}")
+    lhs, op, rhs = match.groups()
+    if op in ('<', '<='):
+        lhs, rhs = rhs, lhs
+    form = linear_form(lhs, env)
+    for name, coeff in linear_form(rhs, env).items():
+        form[name] = form.get(name, 0) - coeff
+    if op in ('>', '<'):
+        form[1] -= 1  # integers: a > b is a - b - 1 >= 0
+    return {name: coeff for name, coeff in form.items() if coeff or name == 1}
+
+def eval_form(form, env, n):
+    """Values of a form for n rows, env mapping each of its names to an array."""
+    out = np.full(n, form[1], dtype=np.int64)
+    for name, coeff in form.items():
+        if name != 1:
+            out += coeff * env[name]
+    return out
+
+# Compiled (rule, X1, X2) forms kept; compiling is cheap, this only spares repeat runs
+COMPILED_RULES = 64
+
+class CombinationRule:
+    """
+    Declarative description of one combination type.
+
+        free          the variables that range over the list values, one or
+                      two (outer loop first)
+        values        derived values in order, as linear expressions of the
+                      free variables, X1, X2 and earlier values
+        order         the values of a result tuple, in column order
+        where         extra conditions such as 'M > X1'
+        nwis_checks   (toggle, expression) pairs: with the toggle on, the
+                      expression must not be in the Not Wanted List
+        table         (column, expression) pairs of df_with_inter; None takes
+                      the column from the bin counts
+        rank          sort keys: '-bins' (descending), 'sum' or a tuple value
+        formatted     (columns, block_rows, blank_row) for build_formatted
+        color_block   {'width', 'rows'} layout for color_workbook_bytes
+        blank_column  position of an all-'' column in df_with_inter, if any
+        message       status message of a finished run
+
+    Every value of a tuple must be a number of the lists, with at least as
+    many copies there as in the tuple. In the layouts, _Field('X1') and
+    _Field('X2') stand for the parameters.
+    """
+    def __init__(self, free, values, order, table, rank, formatted, color_block=None, where=(),
+                 nwis_checks=(), blank_column=None, message="Combinations generated!"):
+        if len(free) not in (1, 2):
+            raise ValueError("a rule has one or two free variables")
+        self.free = tuple(free)
+        self.values = dict(values)
+        self.order = tuple(order)
+        self.where = tuple(where)
+        self.nwis_checks = tuple(nwis_checks)
+        self.table = list(table)
+        self.rank = tuple(rank)
+        self.formatted = formatted
+        self.color_block = color_block
+        self.blank_column = blank_column
+        self.message = message
+
+    @property
+    def width(self):
+        return len(self.order)
+
+    @property
+    def tuple_columns(self):
+        """The df_with_inter column of each tuple value."""
+        return [next(column for column, expr in self.table if expr == name) for name in self.order]
+
+    def compile(self, X1, X2):
+        """
+        Every expression of the rule as a form over the free variables, for
+        this X1 and X2 (the COMPILED_RULES most recent pairs of all rules are cached):
+        {'values': {name: form}, 'where': [form >= 0], 'checks': [(toggle, form)],
+         'table': [(column, form or None)]}.
+        """
+        return self._compile(int(X1), int(X2))
+
+    @lru_cache(maxsize=COMPILED_RULES)
+    def _compile(self, X1, X2):
+        env = {'X1': {1: X1}, 'X2': {1: X2}}
+        env.update((var, {var: 1, 1: 0}) for var in self.free)
+        for name, expr in self.values.items():
+            env[name] = linear_form(expr, env)
+        return {
+            'values': {name: env[name] for name in self.order},
+            'where': [comparison_form(condition, env) for condition in self.where],
+            'checks': [(toggle, linear_form(expr, env)) for toggle, expr in self.nwis_checks],
+            'table': [(column, None if expr is None else linear_form(expr, env))
+                      for column, expr in self.table],
+        }
+
+    def variables(self, form):
+        """The free variables a form depends on, in the order of self.free."""
+        return tuple(var for var in self.free if form.get(var))
+
+    def columns(self, tuples):
+        """The free variables as arrays, taken from the columns of an (n, width) tuple array."""
+        return {var: tuples[:, self.order.index(var)] for var in self.free}
+
+# Layouts shared by the rules. Visualized frame: 2 rows per result + a blank row.
+_BIN_FIELDS = [_Field(name) for name in BIN_COLUMNS]
+_BIN_LABELS = ['Priority', '2nd', '3rd', 'Backup']
+_TRIPLE_FORMATTED_COLUMNS = ['Gen', 'Main', 'Subsidary', 'Exterior', 'Total', '--'] + BIN_COLUMNS
+_TRIPLE_VALUE_ROW = [_Field('Gen'), _Field('Main'), _Field('Subsidary'), _Field('Ext'), '', ''] + _BIN_LABELS
+
+# Colour-coded workbook: cells as (value, fill name) per column.
+# Every cell in these rows is centred; rows are padded to the layout width.
+_COUNT_HEADERS = [("Priority", None), ("2nd", None), ("3rd", None), ("Backup", None)]
+_COUNT_VALUES = [(_Field('Priority_count'), None), (_Field('2nd_count'), None),
+                 (_Field('3rd_count'), None), (_Field('Backup_count'), None)]
+_SECOND_ROW = [(_Field('triple_str'), None), (_Field('Gen'), 'light_blue'), (_Field('Main'), 'purple'),
+               (_Field('Subsidary'), 'green'), (_Field('Ext'), 'tea_green'), ("", 'orange'), ("", None)] + _COUNT_VALUES
+_LABEL_ROW = [("", None), ("Gen", 'light_blue'), ("Main", 'purple'), ("Subsidary", 'green'),
+              ("Exterior", 'tea_green'), ("Total", 'orange')]
+
+# What the four triple methods share: the (M, S, T, Ext, Gen) tuple and its columns
+_TRIPLE = dict(
+    free=('M',),
+    order=('M', 'S', 'T', 'Ext', 'Gen'),
+    rank=('-bins', 'sum', 'M', 'S', 'T', 'Ext', 'Gen'),
+)
+_TRIPLE_TABLE = [('Main', 'M'), ('Subsidary', 'S'), ('Total', 'T'), ('Ext', 'Ext'), ('Gen', 'Gen')]
+_TRIPLE_SUM = [(name, None) for name in BIN_COLUMNS] + [('Sum(M,S,T,E,G)', 'M + S + T + Ext + Gen')]
+
+COMBINATION_RULES = {
+    'single': CombinationRule(
+        **_TRIPLE,
+        values={'S': 'M - X1 + 1', 'T': 'M', 'Ext': '2', 'Gen': '6'},
+        where=('M > X1',),
+        nwis_checks=[(TOGGLE_M_S, 'M'), (TOGGLE_M_S, 'S'), (TOGGLE_T, 'T'), (TOGGLE_G, 'Gen'),
+                     (TOGGLE_E, 'Ext'), (STRICT_SWITCH, 'M - 5')],
+        table=_TRIPLE_TABLE + [('M1', 'M - X1'), ('M2', '0')] + _TRIPLE_SUM,
+        formatted=(_TRIPLE_FORMATTED_COLUMNS, [
+            [_Field('X1'), _Field('M1'), _Field('M2'), '', _Field('Total'), ''] + _BIN_FIELDS,
+            _TRIPLE_VALUE_ROW,
+        ], None),
+        color_block={'width': 11, 'rows': [
+            [("", None), ("X", 'blue'), ("M1", 'yellow'), ("", None), ("", None), ("Dual", 'purple')],
+            [("(M,S,T,E,G)", None), (_Field('X1'), 'blue'), (_Field('M1'), 'yellow'), ("", None), ("", None),
+             (_Field('Total'), 'orange'), ("", None)] + _COUNT_HEADERS,
+            _SECOND_ROW,
+            _LABEL_ROW,
+        ]},
+    ),
+    'dual': CombinationRule(
+        **{**_TRIPLE, 'free': ('M', 'S')},
+        values={'T': 'S + X1', 'Ext': 'S - M + X1 + 1', 'Gen': 'X1 + 1'},
+        where=('M > X1', 'S > M - X1'),
+        nwis_checks=[(TOGGLE_M_S, 'M'), (TOGGLE_T, 'T'), (TOGGLE_G, 'Gen'), (TOGGLE_E, 'Ext'),
+                     (STRICT_SWITCH, 'M - 5'), (STRICT_SWITCH, 'S - M + 5')],
+        table=_TRIPLE_TABLE + [('M1', 'M - X1'), ('M2', 'S - M + X1')] + _TRIPLE_SUM,
+        formatted=(_TRIPLE_FORMATTED_COLUMNS, [
+            [_Field('X1'), _Field('M1'), _Field('M2'), '', _Field('Total'), ''] + _BIN_FIELDS,
+            _TRIPLE_VALUE_ROW,
+        ], None),
+        color_block={'width': 11, 'rows': [
+            [("", None), ("X", 'blue'), ("M1", 'yellow'), ("M2", 'peach'), ("", None), ("Dual", 'purple')],
+            [("(M,S,T,E,G)", None), (_Field('X1'), 'blue'), (_Field('M1'), 'yellow'), (_Field('M2'), 'peach'),
+             ("", None), (_Field('Total'), 'orange'), ("", None)] + _COUNT_HEADERS,
+            _SECOND_ROW,
+            _LABEL_ROW,
+        ]},
+    ),
+    'double_single': CombinationRule(
+        **_TRIPLE,
+        values={'S': 'M - X2 + 1', 'T': 'M + X1', 'Ext': 'X1 + 1', 'Gen': 'X1 + 1'},
+        where=('M > X2',),
+        nwis_checks=[(TOGGLE_M_S, 'M'), (TOGGLE_M_S, 'S'), (TOGGLE_T, 'T'), (TOGGLE_G, 'Gen'),
+                     (TOGGLE_E, 'Ext'), (STRICT_SWITCH, 'S - 1')],
+        table=_TRIPLE_TABLE + [('M1', 'S - 1')] + _TRIPLE_SUM,
+        formatted=(_TRIPLE_FORMATTED_COLUMNS, [
+            [_Field('X1'), _Field('X2'), _Field('M1'), '', _Field('Total'), ''] + _BIN_FIELDS,
+            _TRIPLE_VALUE_ROW,
+        ], None),
+        color_block={'width': 11, 'rows': [
+            [("", None), ("X1", 'blue'), ("X2", 'blue'), ("M1", 'yellow'), ("", None), ("Double Single", 'purple')],
+            [("(M,S,T,E,G)", None), (_Field('X1'), 'blue'), (_Field('X2'), 'blue'), (_Field('M1'), 'yellow'),
+             ("", None), (_Field('Total'), 'orange'), ("", None)] + _COUNT_HEADERS,
+            _SECOND_ROW,
+            _LABEL_ROW,
+        ]},
+    ),
+    'double_dual': CombinationRule(
+        **{**_TRIPLE, 'free': ('M', 'S')},
+        values={'T': 'S + X1 + X2', 'Ext': 'S - M + X1 + X2', 'Gen': 'X1 + 1'},
+        where=('M > X2', 'S > M - X2'),
+        nwis_checks=[(TOGGLE_M_S, 'M'), (TOGGLE_T, 'T'), (TOGGLE_G, 'Gen'), (TOGGLE_E, 'Ext'),
+                     (STRICT_SWITCH, 'M - 15'), (STRICT_SWITCH, 'S - M + 15')],
+        table=_TRIPLE_TABLE + [('M1', 'M - X2'), ('M2', 'S - M + X2')] + _TRIPLE_SUM,
+        formatted=(['Gen', 'Main', 'Subsidary', '---', 'Exterior', 'Total', '--'] + BIN_COLUMNS, [
+            [_Field('X1'), _Field('X2'), _Field('M1'), _Field('M2'), '', _Field('Total'), ''] + _BIN_FIELDS,
+            [_Field('Gen'), _Field('Main'), _Field('Subsidary'), '', _Field('Ext'), '', ''] + _BIN_LABELS,
+        ], [''] * 10 + [None]),  # the empty row has always left Backup_count unset
+        color_block={'width': 12, 'rows': [
+            [("", None), ("X1", 'blue'), ("X2", 'blue'), ("M1", 'yellow'), ("M2", 'peach'), ("", None),
+             ("Double Dual", 'purple')],
+            [("(M,S,T,E,G)", None), (_Field('X1'), 'blue'), (_Field('X2'), 'blue'), (_Field('M1'), 'yellow'),
+             (_Field('M2'), 'peach'), ("", None), (_Field('Total'), 'orange'), ("", None)] + _COUNT_HEADERS,
+            [(_Field('triple_str'), None), (_Field('Gen'), 'light_blue'), (_Field('Main'), 'purple'),
+             (_Field('Subsidary'), 'green'), ("", 'green'), (_Field('Ext'), 'tea_green'), ("", 'orange'),
+             ("", None)] + _COUNT_VALUES,
+            [("", None), ("Gen", 'light_blue'), ("Main", 'purple'), ("Subsidary", 'green'), ("", 'green'),
+             ("Exterior", 'tea_green'), ("Total", 'orange')],
+        ]},
+    ),
+    # The 'double' fallback: (A, B) with A = B + 4, ranked by A only
+    'double': CombinationRule(
+        free=('B',),
+        values={'A': 'B + 4'},
+        order=('A', 'B'),
+        where=('B > 1',),
+        nwis_checks=[(TOGGLE_M_S, 'B'), (TOGGLE_T, 'A'), (STRICT_SWITCH, 'B - 1')],
+        table=[('B', 'B'), ('SUM', 'A'), ('M1', 'B - 1')] + [(name, None) for name in BIN_COLUMNS],
+        rank=('A',),
+        formatted=(['-', 'B', '', 'SUM', '--'] + BIN_COLUMNS, [
+            ['', _Field('B'), '', '', ''] + _BIN_LABELS,
+            [5, _Field('M1'), '', _Field('SUM'), ''] + _BIN_FIELDS,
+        ], None),
+        blank_column=1,  # the empty column between B and SUM
+        message="Combinations generated Double!",
+    ),
+}
+
+def iter_candidate_blocks(method_selection, counts, nwis, X1, X2, toggle_M_S, strict_switch,
+                          toggle_T, toggle_G, toggle_E, chunk_size=1_000_000):
+    """
+    Valid tuples of a method as a stream of (tuples, progress) pairs, tuples
+    being an (n, width) int array and progress the fraction of the search done.
+
+    The compiled COMBINATION_RULES entry is evaluated test by test, where a
+    test is "value is a number of the lists", a where condition or an
+    enabled Not Wanted List check:
+      - tests on constants (Gen, ...) are made once up front,
+      - tests on one free variable filter that variable's candidate values,
+      - with two free variables, the tests mixing them that are linear bounds
+        on the inner one (where conditions, and "value lies between the
+        smallest and largest list number") become a searchsorted range of
+        the sorted inner candidates per outer value. Only the (outer, inner)
+        pairs inside those ranges are expanded, in blocks of at most
+        chunk_size (starting at FIRST_BLOCK_SIZE and doubling), and the
+        remaining tests are applied to them.
+    Every block then gets the multiplicity check (enough_counts_mask). Tuples come in ascending
+    (outer, inner) order, like the nested loops they replace.
+    """
+    rule = COMBINATION_RULES[method_selection]
+    compiled = rule.compile(X1, X2)
+    toggles = (toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E)
+    keys = np.array(sorted(counts), dtype=np.int64)
+    if len(keys) == 0:
+        return
+    table = counts_lookup_table(counts)
+    if not isinstance(nwis, ExclusionIndex):
+        nwis = ExclusionIndex(nwis)
+
+    def in_counts(values):
+        return lookup_counts(values, table) > 0
+
+    def not_in_nwis(values):
+        return ~nwis.mask(values)
+
+    # (form, test) pairs grouped by the free variables they depend on.
+    # A free variable itself is always a number of the lists, so it needs no test.
+    tests = [(form, in_counts) for name, form in compiled['values'].items() if name not in rule.free]
+    tests += [(form, not_in_nwis) for toggle, form in compiled['checks'] if toggles[toggle]]
+    tests += [(form, lambda values: values >= 0) for form in compiled['where'] if len(rule.variables(form)) < 2]
+    grouped = {}
+    for form, test in tests:
+        grouped.setdefault(rule.variables(form), []).append((form, test))
+
+    for form, test in grouped.pop((), []):
+        if not test(np.array([form[1]], dtype=np.int64))[0]:
+            return
+    candidates = {}
+    for var in rule.free:
+        values = keys
+        for form, test in grouped.get((var,), []):
+            values = values[test(eval_form(form, {var: values}, len(values)))]
+        candidates[var] = values
+
+    def finish(env, n):
+        columns = [eval_form(form, env, n) for form in compiled['values'].values()]
+        keep = enough_counts_mask(columns, table)
+        return np.stack([column[keep] for column in columns], axis=1)
+
+    if len(rule.free) == 1:
+        var = rule.free[0]
+        yield finish({var: candidates[var]}, len(candidates[var])), 1.0
+        return
+
+    outer, inner = rule.free
+    o_vals, i_vals = candidates[outer], candidates[inner]
+    if len(o_vals) == 0 or len(i_vals) == 0:
+        return
+
+    # Linear bounds a*outer + b*inner + c >= 0 on the inner variable
+    bounds = [form for form in compiled['where'] if len(rule.variables(form)) == 2]
+    for name, form in compiled['values'].items():
+        if len(rule.variables(form)) == 2:
+            bounds.append({**form, 1: form[1] - keys[0]})
+            bounds.append({**{var: -coeff for var, coeff in form.items()}, 1: keys[-1] - form[1]})
+    starts = np.zeros(len(o_vals), dtype=np.int64)
+    ends = np.full(len(o_vals), len(i_vals), dtype=np.int64)
+    for form in bounds:
+        a, b = form.get(outer, 0), form[inner]
+        rest = a * o_vals + form[1]
+        if b > 0:   # inner >= ceil(-rest / b)
+            starts = np.maximum(starts, np.searchsorted(i_vals, -(rest // b), side='left'))
+        else:       # inner <= floor(rest / -b)
+            ends = np.minimum(ends, np.searchsorted(i_vals, rest // -b, side='right'))
+    lengths = np.maximum(ends - starts, 0)
+    cum_lengths = np.cumsum(lengths)
+    total_pairs = max(int(cum_lengths[-1]), 1)
+    mixed = grouped.get((outer, inner), [])
+
+    block_start = 0
+    block_size = min(FIRST_BLOCK_SIZE, chunk_size)
+    while block_start < len(o_vals):
+        done = cum_lengths[block_start - 1] if block_start else 0
+        block_end = int(np.searchsorted(cum_lengths, done + block_size, side='right'))
+        block_end = max(block_end, block_start + 1)
+        block_size = min(block_size * 2, chunk_size)
+
+        block_lengths = lengths[block_start:block_end]
+        total = int(block_lengths.sum())
+        if total:
+            rows = np.repeat(np.arange(block_start, block_end), block_lengths)
+            first = np.repeat(np.cumsum(block_lengths) - block_lengths, block_lengths)
+            env = {outer: o_vals[rows], inner: i_vals[starts[rows] + (np.arange(total) - first)]}
+            mask = np.ones(total, dtype=bool)
+            for form, test in mixed:
+                mask &= test(eval_form(form, env, total))
+            env = {var: values[mask] for var, values in env.items()}
+            yield finish(env, int(mask.sum())), int(cum_lengths[block_end - 1]) / total_pairs
+        block_start = block_end
+
+def enumerate_combinations(method_selection, counts, nwis, X1, X2, toggle_M_S, strict_switch, toggle_T,
+                           toggle_G, toggle_E):
+    """Valid tuples of a method as a list of tuples, (M, S, T, Ext, Gen) or (A, B)."""
+    results = []
+    for block, _ in iter_candidate_blocks(method_selection, counts, nwis, X1, X2, toggle_M_S, strict_switch,
+                                          toggle_T, toggle_G, toggle_E):
+        results.extend(map(tuple, block.tolist()))
+    return results
+
+# Enumeration by method name; all take (counts, nwis, X1, X2, *toggles)
+ENUMERATORS = {method: partial(enumerate_combinations, method) for method in COMBINATION_RULES}
+
+def nwis_filter_mask(method_selection, X1, X2, toggles, nwis, tuples):
+    """
+    Rows of tuples that pass every Not Wanted List check of the rule that
+    toggles enable. Candidates enumerated with NO_TOGGLES and an empty list,
+    filtered by this mask, are exactly the tuples enumerated with toggles
+    and nwis, in the same order.
+    """
+    rule = COMBINATION_RULES[method_selection]
+    env = rule.columns(tuples)
+    mask = np.ones(len(tuples), dtype=bool)
+    for toggle, form in rule.compile(X1, X2)['checks']:
+        if toggles[toggle]:
+            mask &= ~nwis.mask(eval_form(form, env, len(tuples)))
+    return mask
+
+def iter_result_blocks(method_selection, X1, X2, toggles, counts, nwis, bin_index, perf=None):
+    """
+    The pipeline of generate_results as a generator:
+    candidates -> validation -> bin counts -> "used exactly k items" filter.
+    Yields (tuples, bins, progress) per block, in enumeration (not ranked) order.
+    With a PerfRecorder, the time spent in the enumeration and in the bin
+    counting is recorded as the 'enumerate' and 'bins' stages.
+    """
+    blocks = iter_candidate_blocks(method_selection, counts, nwis, X1, X2, *toggles)
+    while True:
+        with perf_stage(perf, 'enumerate'):
+            item = next(blocks, None)
+        if item is None:
+            return
+        block, progress = item
+        with perf_stage(perf, 'bins'):
+            bins = bin_index.bins_batch(block)
+            keep = bins.sum(axis=1) == block.shape[1]
+        yield block[keep], bins[keep], progress
+
+def rank_keys(method_selection, tuples, bins):
+    """
+    Sort keys of generate_results as an (n, m) int array, one row per tuple,
+    from the rank of the rule: for the triple methods bins descending, then
+    the sum and the values ascending ('double' sorts by A only).
+    """
+    rule = COMBINATION_RULES[method_selection]
+    keys = []
+    for key in rule.rank:
+        if key == '-bins':
+            keys.append(-bins)
+        elif key == 'sum':
+            keys.append(tuples.sum(axis=1, keepdims=True))
+        else:
+            keys.append(tuples[:, rule.order.index(key)][:, None])
+    return np.hstack(keys)
+
+def check_top_k(top_k):
+    """Reject a negative top_k (None and 0 mean all rows)."""
+    if top_k is not None and top_k < 0:
+        raise ValueError(f"top_k must be 0 (all rows) or a positive number of rows, got {top_k}")
+
+def ranked_top_k(method_selection, X1, X2, toggles, counts, nwis, bin_index, k, on_block=None, perf=None):
+    """
+    The k best rows in generate_results order, i.e. the first k rows of the
+    full sort after the bins filter, as (tuples, bins) arrays.
+
+    Candidate blocks are binned, filtered and ranked as they stream in, and
+    only a heap of the k best entries so far is kept, so the full result list
+    is never built.
+    """
+    width = COMBINATION_RULES[method_selection].width
+    heap = []  # (negated rank key, tuple, bins); heap[0] is the worst kept entry
+    for block, bins, progress in iter_result_blocks(
+            method_selection, X1, X2, toggles, counts, nwis, bin_index, perf):
+        if on_block is not None:
+            on_block(block, bins, progress)
+        if not len(block):
+            continue
+        with perf_stage(perf, 'sort'):
+            keys = rank_keys(method_selection, block, bins)
+            for i in np.lexsort(keys.T[::-1])[:k]:
+                neg_key = tuple(-x for x in keys[i].tolist())
+                entry = (neg_key, tuple(block[i].tolist()), bins[i].tolist())
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif neg_key > heap[0][0]:
+                    heapq.heapreplace(heap, entry)
+                else:
+                    break  # the rest of this block ranks lower still
+    ranked = sorted(heap, reverse=True)
+    return (np.array([entry[1] for entry in ranked], dtype=np.int64).reshape(-1, width),
+            np.array([entry[2] for entry in ranked], dtype=np.int64).reshape(-1, 4))
+
+def ranked_results(method_selection, X1, X2, toggles, counts, nwis, bin_index, top_k=None, on_block=None,
+                   perf=None):
+    """
+    All rows that pass the filters, in generate_results order, as a
+    (tuples, bins) pair of int arrays (only the top_k best with top_k).
+    on_block(tuples, bins, progress) is
+    called for every block as it comes out of iter_result_blocks, so callers
+    can show partial results before the ranking is done.
+    """
+    check_top_k(top_k)
+    if top_k:
+        return ranked_top_k(method_selection, X1, X2, toggles, counts, nwis, bin_index, top_k, on_block, perf)
+    width = COMBINATION_RULES[method_selection].width
+    blocks, bin_blocks = [np.empty((0, width), dtype=np.int64)], [np.empty((0, 4), dtype=np.int64)]
+    for block, bins, progress in iter_result_blocks(
+            method_selection, X1, X2, toggles, counts, nwis, bin_index, perf):
+        if on_block is not None:
+            on_block(block, bins, progress)
+        blocks.append(block)
+        bin_blocks.append(bins)
+    with perf_stage(perf, 'sort'):
+        tuples, bins = np.concatenate(blocks), np.concatenate(bin_blocks)
+        order = np.lexsort(rank_keys(method_selection, tuples, bins).T[::-1])
+        return tuples[order], bins[order]
+
+def rejection_counts(method_selection, X1, X2, toggles, counts, nwis, bin_index):
+    """
+    How many candidate tuples each rule rejects, as a funnel: the tuples the
+    arithmetic of the method allows, then the Not Wanted List toggles, the
+    strict intermediate check, the multiplicity check (enough copies of every
+    number) and the "used exactly k items" bins filter, in that order.
+    The earlier steps re-run the enumeration with the later rules switched
+    off; the multiplicity check is switched off by pretending every number
+    has as many copies as a tuple can need.
+    """
+    toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E = toggles
+    plenty = dict.fromkeys(counts, 5)
+
+    def candidates(counts, toggles):
+        return sum(len(block) for block, _ in
+                   iter_candidate_blocks(method_selection, counts, nwis, X1, X2, *toggles))
+
+    funnel = [
+        candidates(plenty, (False, False, False, False, False)),
+        candidates(plenty, (toggle_M_S, False, toggle_T, toggle_G, toggle_E)),
+        candidates(plenty, toggles),
+        candidates(counts, toggles),
+        count_valid_rows(method_selection, X1, X2, toggles, counts, nwis, bin_index),
+    ]
+    return {
+        'candidates': funnel[0],
+        'rejected_nwis': funnel[0] - funnel[1],
+        'rejected_strict': funnel[1] - funnel[2],
+        'rejected_multiplicity': funnel[2] - funnel[3],
+        'rejected_bins': funnel[3] - funnel[4],
+        'valid_rows': funnel[4],
+    }
+
+class BinIndex:
+    """
+    Precomputed value -> bin multiplicity table for [Main, G, R, C_list],
+    built once per run so compute_bins does not have to copy the lists for
+    every tuple.
+
+    compute_bins gives the k-th occurrence of a number (k = 0, 1, ...) to the
+    first bin whose copies are not used up yet, i.e. to bin b when
+    cum[b-1] <= k < cum[b], where cum is the running total of that number's
+    copies in Priority, 2nd, 3rd and Backup. Occurrences past cum[3] are not
+    counted. Both bins() and bins_batch() apply that rule from the table.
+    """
+    def __init__(self, Main, G, R, C_list):
+        # Copies of every number per bin, counted in NumPy rather than per number in Python
+        bin_lists = [np.asarray(bin_list, dtype=np.int64).ravel() for bin_list in (Main, G, R, C_list)]
+        which_bin = np.repeat(np.arange(4), [len(bin_list) for bin_list in bin_lists])
+        nums, inverse = np.unique(np.concatenate(bin_lists), return_inverse=True)
+        caps = np.zeros((len(nums), 4), dtype=np.int64)
+        np.add.at(caps, (inverse, which_bin), 1)
+        self.nums, self.caps = nums, caps
+        self._capacity = None
+
+        # Cumulative table for the batched path: the running totals of every number
+        self.cum = ValueTable(nums, np.cumsum(caps, axis=1))
+
+    @property
+    def capacity(self):
+        """{number: [copies in Priority, 2nd, 3rd, Backup]}, built on first use by bins()."""
+        if self._capacity is None:
+            self._capacity = dict(zip(self.nums.tolist(), self.caps.tolist()))
+        return self._capacity
+
+    def bins(self, triple):
+        """Same result as compute_bins(triple, Main, G, R, C_list)."""
+        bins = [0, 0, 0, 0]
+        used = Counter()
+        for num in triple:
+            caps = self.capacity.get(num)
+            if caps is None:
+                continue
+            k = used[num]
+            used[num] += 1
+            for b in range(4):
+                if k < caps[b]:
+                    bins[b] += 1
+                    break
+                k -= caps[b]
+        return bins
+
+    def bins_batch(self, tuples):
+        """
+        Bin counts for all tuples at once.
+        Takes a list (or (n, k) array) of tuples and returns an (n, 4) int array.
+        """
+        tuples = np.asarray(tuples, dtype=np.int64)
+        if tuples.size == 0:
+            return np.zeros((0, 4), dtype=np.int64)
+
+        columns = np.ascontiguousarray(tuples.T)
+        bins = np.zeros((len(tuples), 4), dtype=np.int64)
+        for column, rank in zip(columns, occurrence_ranks(columns)):
+            cum = self.cum.take(column)
+            # Bin index 0..3, or 4 when every copy is already used
+            bin_of = (rank[:, None] >= cum).sum(axis=1)
+            for b in range(4):
+                bins[:, b] += bin_of == b
+        return bins
+
+def compute_bins(triple, Main, G, R, C_list):
+    """
+    Calculate how many numbers in the triple come from
+    each bin: [Main, G, R, C_list].
+    """
+    bins = [0, 0, 0, 0]  # [Priority_count, 2nd_count, 3rd_count, Backup_count]
+
+    # Copies so original data is not modified
+    main_copy = Main.copy()
+    g_copy    = G.copy()
+    r_copy    = R.copy()
+    c_copy    = C_list.copy()
+
+    for num in triple:
+        if num in main_copy:
+            bins[0] += 1
+            main_copy.remove(num)
+        elif num in g_copy:
+            bins[1] += 1
+            g_copy.remove(num)
+        elif num in r_copy:
+            bins[2] += 1
+            r_copy.remove(num)
+        elif num in c_copy:
+            bins[3] += 1
+            c_copy.remove(num)
+    return bins
+
+def build_formatted(df_with_inter, block_rows, columns, blank_row=None, first_index=1):
+    """
+    Build the "Combinations Visualized" frame column by column.
+
+    Every result becomes len(block_rows) rows followed by blank_row
+    (all '' by default). Each entry of a block row is either a _Field naming
+    a column of df_with_inter, or a constant. Output columns are filled with
+    strided slice assignments, so there is no per-row Python work.
+    """
+    n = len(df_with_inter)
+    rows_per_block = len(block_rows) + 1
+    if blank_row is None:
+        blank_row = [''] * len(columns)
+
+    data = np.empty((n * rows_per_block, len(columns)), dtype=object)
+    for c in range(len(columns)):
+        for r, row in enumerate(block_rows):
+            entry = row[c]
+            if isinstance(entry, _Field):
+                data[r::rows_per_block, c] = df_with_inter[entry.name].to_numpy()
+            else:
+                data[r::rows_per_block, c] = entry
+        data[len(block_rows)::rows_per_block, c] = blank_row[c]
+
+    df_formatted = pd.DataFrame(data, columns=columns)
+    df_formatted.index = range(first_index, first_index + len(df_formatted))
+    return df_formatted
+
+def formatted_layout(method_selection, X1, X2):
+    """(block_rows, columns, blank_row) of the Combinations Visualized frame, see build_formatted."""
+    columns, block_rows, blank_row = COMBINATION_RULES[method_selection].formatted
+    params = {'X1': X1, 'X2': X2}
+    block_rows = [[params[entry.name] if isinstance(entry, _Field) and entry.name in params else entry
+                   for entry in row] for row in block_rows]
+    return block_rows, columns, blank_row
+
+def formatted_frame(method_selection, X1, X2, df_with_inter, first_index=1):
+    """
+    Combinations Visualized frame for the rows of df_with_inter (all of them,
+    or one page), numbered from first_index.
+    """
+    block_rows, columns, blank_row = formatted_layout(method_selection, X1, X2)
+    return build_formatted(df_with_inter, block_rows, columns, blank_row, first_index)
+
+def result_positions(df_with_inter, sort_by=None, descending=False, filter_column=None, filter_range=None):
+    """
+    Row positions of df_with_inter to display, in display order. Rows keep
+    the rank order unless sort_by names a column (stable sort); with
+    filter_column only rows whose value lies in filter_range (inclusive)
+    are kept. Only positions are sorted and filtered, so a page of the
+    result is df_with_inter.iloc[positions[start:stop]] and no other frame
+    gets built.
+    """
+    positions = np.arange(len(df_with_inter))
+    if filter_column is not None:
+        lo, hi = filter_range
+        column = df_with_inter[filter_column].to_numpy()
+        positions = positions[(column >= lo) & (column <= hi)]
+    if sort_by is not None:
+        column = df_with_inter[sort_by].to_numpy()[positions]
+        order = np.argsort(-column if descending else column, kind='stable')
+        positions = positions[order]
+    return positions
+
+def count_valid_rows(method_selection, X1, X2, toggles, counts, nwis, bin_index):
+    """
+    Number of rows generate_results would keep for these parameters, without
+    building any frames. Used by parameter sweeps, where counts, nwis and
+    bin_index stay the same across many runs.
+    """
+    return sum(len(block) for block, _, _ in
+               iter_result_blocks(method_selection, X1, X2, toggles, counts, nwis, bin_index))
+
+# tracemalloc is global to the process: recorders in use (one per session,
+# run or worker thread) share it, and the last one to finish stops it
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_users += 1
+
+def _stop_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+class PerfRecorder:
+    """
+    Wall time, peak traced memory and counters per pipeline stage.
+    Stages entered more than once (e.g. per enumeration block) add up; the
+    peak is the largest seen in any call. Memory is only measured while the
+    recorder is used as a context manager, which runs tracemalloc. Tracing
+    is process-wide, so the peak of a stage includes whatever other threads
+    allocated at the same time.
+    """
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.stages = {}
+        self.counts = {}
+        self._tracing = 0  # how many times this recorder holds tracemalloc
+
+    def __enter__(self):
+        if self.track_memory:
+            _start_tracing()
+            self._tracing += 1
+        return self
+
+    def __exit__(self, *exc):
+        if self._tracing:
+            self._tracing -= 1
+            _stop_tracing()
+
+    @contextmanager
+    def stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_mb': None})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+            if tracing:
+                peak_mb = (tracemalloc.get_traced_memory()[1] - base) / 2**20
+                entry['peak_mb'] = max(entry['peak_mb'] or 0.0, peak_mb)
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + int(value)
+
+    def as_dict(self):
+        return {'stages': self.stages, 'counts': self.counts}
+
+    def to_json(self, **extra):
+        """One structured log line with the stages, the counts and any extra fields."""
+        return json.dumps({**extra, **self.as_dict()})
+
+def perf_stage(perf, name):
+    """perf.stage(name), or a no-op without a PerfRecorder."""
+    return nullcontext() if perf is None else perf.stage(name)
+
+def result_table(method_selection, X1, X2, tuples, bins):
+    """
+    Every numeric column of df_with_inter as one compact (n, m) int array
+    (int32 unless a value needs more), with the column names, as listed in
+    the table of the rule: for the triple methods the tuple, the
+    intermediate values M1 (and M2), the bins and the tuple sum; for
+    'double' B, SUM, M1 and the bins.
+    """
+    rule = COMBINATION_RULES[method_selection]
+    env = rule.columns(tuples)
+    values = [bins[:, BIN_COLUMNS.index(column)] if form is None else eval_form(form, env, len(tuples))
+              for column, form in rule.compile(X1, X2)['table']]
+    return compact_ints(np.column_stack(values)), [column for column, _ in rule.table]
+
+def ranked_candidates(method_selection, X1, X2, counts, bin_index, on_block=None, perf=None):
+    """
+    ranked_results before any Not Wanted List check: every tuple the
+    arithmetic, the multiplicity check and the bins filter allow, ranked.
+    Any NWIS / toggle combination is then a nwis_filter_mask away.
+    """
+    return ranked_results(method_selection, X1, X2, NO_TOGGLES, counts, ExclusionIndex(()), bin_index,
+                          on_block=on_block, perf=perf)
+
+def generate_results(method_selection, X1, X2, toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E,
+                     Main, G, R, C_list, not_wanted_in_sum, top_k=None, on_block=None, perf=None,
+                     candidate_cache=None):
+    """
+    Run the combinations logic for one method.
+    Returns a dict with the status message and df_with_inter, the canonical
+    result (tuple, intermediate values, bins and sum) that every display and
+    export reads. df_with_inter wraps the array from result_table without
+    copying it. The visualized blocks are built from it on demand, for the
+    rows shown, by formatted_frame.
+    With top_k, only the top_k best ranked rows are kept (see ranked_top_k);
+    on_block receives the partial results while they are enumerated (see ranked_results).
+    A PerfRecorder gets the time and memory of every stage and the
+    rejection_counts funnel (which costs a few extra enumeration passes).
+
+    With a candidate_cache (a ResultCache), the ranked_candidates of the
+    method, X1/X2 and the four lists are kept in it, so a run that only
+    changes the Not Wanted List or the toggles just re-applies
+    nwis_filter_mask, and concurrent runs share one enumeration. Top-K runs
+    use cached candidates when they exist but never build them, to keep
+    their memory bounded, and so do runs whose candidates were too large
+    for the cache: they enumerate with their own toggles and NWIS instead.
+    """
+    check_top_k(top_k)
+    with perf_stage(perf, 'index'):
+        nwis = ExclusionIndex(not_wanted_in_sum)
+
+    # ---------------------------------------------------------------
+    # 4) MAIN LOGIC
+    # ---------------------------------------------------------------
+    # 4a) Filter out NWIS items
+    # Main   = remove_nwis(Main, nwis)
+    # G      = remove_nwis(G, nwis)
+    # R      = remove_nwis(R, nwis)
+    # C_list = remove_nwis(C_list, nwis)
+
+    # 4b) Create a major list and get counts
+    with perf_stage(perf, 'index'):
+        major_list = Main + G + R + C_list
+        counts = Counter(major_list)
+        bin_index = BinIndex(Main, G, R, C_list)
+    toggles = (toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E)
+
+    # 4c) Enumerate, keep the rows that used exactly 5 (2 for doubles) items, and rank them
+    base = None
+    if candidate_cache is not None:
+        key = candidate_cache_key(method_selection, X1, X2, Main, G, R, C_list)
+        if top_k:
+            base = candidate_cache.get(key)
+        elif not candidate_cache.too_large(key):
+            def on_base_block(block, bins, progress):
+                keep = nwis_filter_mask(method_selection, X1, X2, toggles, nwis, block)
+                on_block(block[keep], bins[keep], progress)
+            base, _ = candidate_cache.get_or_compute(key, lambda: ranked_candidates(
+                method_selection, X1, X2, counts, bin_index, on_base_block if on_block is not None else None, perf))
+    if base is not None:
+        with perf_stage(perf, 'refilter'):
+            keep = nwis_filter_mask(method_selection, X1, X2, toggles, nwis, base[0])
+            tuples, bins = base[0][keep][:top_k or None], base[1][keep][:top_k or None]
+    else:
+        tuples, bins = ranked_results(
+            method_selection, X1, X2, toggles, counts, nwis, bin_index, top_k, on_block, perf)
+
+    # 4d) Both frames are views of one int array
+    with perf_stage(perf, 'dataframe'):
+        values, columns = result_table(method_selection, X1, X2, tuples, bins)
+        df_with_inter = pd.DataFrame(values, columns=columns, index=range(1, len(values) + 1), copy=False)
+    if perf is not None:
+        with perf.stage('rejection_counts'):
+            for name, value in rejection_counts(method_selection, X1, X2, toggles, counts, nwis, bin_index).items():
+                perf.count(name, value)
+        perf.count('rows_kept', len(df_with_inter))
+
+    rule = COMBINATION_RULES[method_selection]
+    if rule.blank_column is not None:
+        # The only non-numeric column
+        df_with_inter.insert(rule.blank_column, '', '')
+
+    return {
+        'message': rule.message,
+        'df_with_inter': df_with_inter,
+    }
+
+def output_filenames(method_selection, strict_switch):
+    """File names for the two downloads, adjusted for strict if needed."""
+    valid_filename = "valid_combinations.xlsx"
+    color_filename = "visualized_with_color.xlsx"
+    if strict_switch:
+        valid_filename = "valid_combinations_strict.xlsx"
+        color_filename = "visualized_with_color_strict.xlsx"
+    return f"{method_selection}_{valid_filename}", f"{method_selection}_{color_filename}"
+
+# Columnar / text exports of df_with_inter next to the two workbooks:
+# kind -> (file extension, MIME type). Parquet and Arrow need pyarrow.
+DATA_EXPORTS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv_gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+CSV_CHUNK_ROWS = 100_000
+
+def pyarrow_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+def _arrow_table(df_with_inter):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("Parquet and Arrow exports need pyarrow (pip install pyarrow)") from None
+    return pa.Table.from_pandas(df_with_inter, preserve_index=False)
+
+def iter_csv_chunks(df_with_inter, chunk_rows=CSV_CHUNK_ROWS):
+    """df_with_inter as CSV (no index), encoded chunk by chunk so large results are never one string."""
+    for start in range(0, max(len(df_with_inter), 1), chunk_rows):
+        chunk = df_with_inter.iloc[start:start + chunk_rows]
+        yield chunk.to_csv(index=False, header=start == 0).encode('utf-8')
+
+def write_data_export(df_with_inter, kind, fileobj):
+    """Write one of the DATA_EXPORTS of df_with_inter to a binary file object."""
+    if kind == 'csv':
+        for chunk in iter_csv_chunks(df_with_inter):
+            fileobj.write(chunk)
+    elif kind == 'csv_gz':
+        with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6, mtime=0) as gz:
+            for chunk in iter_csv_chunks(df_with_inter):
+                gz.write(chunk)
+    elif kind == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(_arrow_table(df_with_inter), fileobj)
+    elif kind == 'arrow':
+        import pyarrow as pa
+        table = _arrow_table(df_with_inter)
+        with pa.ipc.new_file(fileobj, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unknown export kind: {kind}")
+
+def export_filename(result, kind):
+    """File name of any export kind of a pipeline result."""
+    if kind in result['filenames']:
+        return result['filenames'][kind]
+    stem = os.path.splitext(result['filenames']['valid'])[0]
+    return stem + DATA_EXPORTS[kind][0]
+
+def valid_workbook_bytes(df_with_inter):
+    """valid_combinations.xlsx (in memory)."""
+    valid_buffer = BytesIO()
+    df_with_inter.to_excel(valid_buffer, index=False)
+    return valid_buffer.getvalue()
+
+def color_workbook_bytes(method_selection, X1, X2, df_with_inter):
+    """
+    visualized_with_color.xlsx (in memory).
+
+    Written with openpyxl's write-only mode so rows go straight to the
+    output instead of being held as cell objects. Each layout position
+    gets one WriteOnlyCell with its style set once; only the value changes
+    between results. Per result there is the 4-row block from
+    the color_block of the rule, an empty row and a row of blank strings.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, PatternFill
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    layout = COMBINATION_RULES[method_selection].color_block
+    if layout is not None and len(df_with_inter):
+        center = Alignment(horizontal="center", vertical="center")
+        fills = {
+            'green': PatternFill(start_color="92D051", fill_type="solid"),
+            'blue': PatternFill(start_color="06B0F0", fill_type="solid"),
+            'yellow': PatternFill(start_color="FFFF00", fill_type="solid"),
+            'light_blue': PatternFill(start_color="CAEDFB", fill_type="solid"),
+            'purple': PatternFill(start_color="D86DCD", fill_type="solid"),
+            'tea_green': PatternFill(start_color="C0F0C8", fill_type="solid"),
+            'orange': PatternFill(start_color="FFBF00", fill_type="solid"),
+            'peach': PatternFill(start_color="F1A983", fill_type="solid"),
+        }
+        width = layout['width']
+
+        # One styled cell per position; _Field positions are refilled per result
+        block = []
+        for template in layout['rows']:
+            cells, fields = [], []
+            for pos in range(width):
+                value, fill_name = template[pos] if pos < len(template) else (None, None)
+                cell = WriteOnlyCell(ws, value=None if isinstance(value, _Field) else value)
+                cell.alignment = center
+                if fill_name is not None:
+                    cell.fill = fills[fill_name]
+                cells.append(cell)
+                if isinstance(value, _Field):
+                    fields.append((cell, value.name))
+            block.append((cells, fields))
+        blank_row = [""] * width
+
+        # Pull every column out once instead of df.iloc[idx][...] per cell
+        columns = {name: df_with_inter[name].tolist() for name in
+                   TUPLE_COLUMNS + BIN_COLUMNS + ['M1', 'M2'] if name in df_with_inter.columns}
+
+        for idx in range(len(df_with_inter)):
+            values = {name: column[idx] for name, column in columns.items()}
+            values['X1'] = X1
+            values['X2'] = X2
+            values['triple_str'] = (f"({values['Main']}, {values['Subsidary']}, {values['Total']}, "
+                                    f"{values['Ext']}, {values['Gen']})")
+            for cells, fields in block:
+                for cell, name in fields:
+                    cell.value = values[name]
+                ws.append(cells)
+            ws.append([])
+            ws.append(blank_row)
+
+    color_buffer = BytesIO()
+    wb.save(color_buffer)
+    return color_buffer.getvalue()
+
+def run_pipeline(method_selection, X1, X2, toggles, Main, G, R, C_list, not_wanted_in_sum, top_k=None,
+                 on_block=None, perf=None, candidate_cache=None):
+    """
+    Everything a press of "Run Combinations Logic" produces: the result
+    frames and the names of both Excel downloads. The workbooks themselves
+    are only built when a download is requested, see export_bytes().
+    A non-zero top_k keeps only the top_k best ranked rows, and on_block is
+    handed the partial results while they are enumerated (see ranked_results).
+    A PerfRecorder is kept on the result as 'perf' so the workbook builds
+    are recorded in it too. candidate_cache is passed on to generate_results.
+    """
+    toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E = toggles
+    result = generate_results(
+        method_selection, X1, X2, toggle_M_S, strict_switch, toggle_T, toggle_G, toggle_E,
+        Main, G, R, C_list, not_wanted_in_sum, top_k=top_k or None, on_block=on_block, perf=perf,
+        candidate_cache=candidate_cache,
+    )
+    valid_filename, color_filename = output_filenames(method_selection, strict_switch)
+    result.update({
+        'method': method_selection,
+        'X1': X1,
+        'X2': X2,
+        'top_k': top_k or None,
+        'filenames': {'valid': valid_filename, 'color': color_filename},
+        'exports': {},
+        'perf': perf,
+    })
+    return result
+
+def export_bytes(result, kind):
+    """
+    Bytes of the 'valid' or 'color' workbook, or of one of the DATA_EXPORTS,
+    for a pipeline result. Built the first time it is asked for and kept on
+    the result, so repeat downloads (and cache hits) do not rebuild it. A
+    result shared between sessions builds each export once: concurrent
+    requests for it wait on the result's export lock.
+    """
+    exports = result['exports']
+    if kind in exports:
+        return exports[kind]
+    with result.setdefault('export_lock', threading.Lock()):
+        if kind not in exports:
+            with perf_stage(result.get('perf'), f'xlsx_{kind}'):
+                if kind == 'valid':
+                    exports[kind] = valid_workbook_bytes(result['df_with_inter'])
+                elif kind == 'color':
+                    exports[kind] = color_workbook_bytes(
+                        result['method'], result['X1'], result['X2'], result['df_with_inter'])
+                else:
+                    buffer = BytesIO()
+                    write_data_export(result['df_with_inter'], kind, buffer)
+                    exports[kind] = buffer.getvalue()
+    return exports[kind]
+
+# ---------------------------------------------------------------
+# Result cache: keep recent pipeline results keyed by the normalized
+# inputs. The Streamlit page shares one between all sessions of the
+# server process (every widget interaction reruns main()), the CLI and
+# the API keep one per process.
+# ---------------------------------------------------------------
+RESULT_CACHE_SIZE = 32
+# ranked_candidates can be much larger than a filtered result, so keep fewer
+CANDIDATE_CACHE_SIZE = 4
+# The page's process-wide caches: result entries, seconds an entry is kept,
+# and MB for both, of which SHARED_CANDIDATE_SHARE goes to the candidates
+SHARED_CACHE_SIZE = 64
+SHARED_CACHE_TTL = 3600
+SHARED_CACHE_MB = 1024
+SHARED_CANDIDATE_SHARE = 0.25
+
+def cached_nbytes(value):
+    """Approximate memory held by a cached value: its frames, arrays and bytes."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=False)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(cached_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(cached_nbytes(item) for item in value)
+    return 0
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with hit/miss counters. Entries older than ttl
+    seconds are dropped, and with max_bytes the least recently used entries
+    are evicted until the cached frames, arrays and export bytes fit (sizes
+    are taken when evicting, so exports built after put() count too). A
+    value larger than max_bytes on its own is not kept, and its key is
+    remembered so callers can check too_large() before building it again.
+    """
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, time stored)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.computing = {}  # key -> {'done': Event, 'value'} of a get_or_compute() in progress
+        self.rejected = OrderedDict()  # keys of values over max_bytes, most recent last
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, key):
+        with self.lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if self.max_bytes is not None and cached_nbytes(value) > self.max_bytes:
+                # Kept out without evicting anything for it
+                self.entries.pop(key, None)
+                self.rejected[key] = True
+                self.rejected.move_to_end(key)
+                while len(self.rejected) > self.max_entries:
+                    self.rejected.popitem(last=False)
+                return
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.max_bytes is not None:
+                total = sum(cached_nbytes(entry[0]) for entry in self.entries.values())
+                # least recently used first
+                while total > self.max_bytes:
+                    _, (evicted, _) = self.entries.popitem(last=False)
+                    total -= cached_nbytes(evicted)
+
+    def too_large(self, key):
+        """Whether the value of key was recently not kept for being over max_bytes."""
+        with self.lock:
+            return key in self.rejected
+
+    def get_or_compute(self, key, compute):
+        """
+        (value, cached) for key, calling compute() on a miss. Concurrent
+        callers with the same key share one computation: the first computes,
+        the others wait for it and get its value (also when it is too large
+        to be kept). If the computation raises, the exception goes to its
+        caller and a waiter takes over.
+        """
+        while True:
+            with self.lock:
+                value = self._lookup(key)
+                if value is not None:
+                    self.hits += 1
+                    return value, True
+                flight = self.computing.get(key)
+                if flight is None:
+                    flight = self.computing[key] = {'done': threading.Event(), 'value': None}
+                    self.misses += 1
+                    break
+            flight['done'].wait()
+            if flight['value'] is not None:
+                with self.lock:
+                    self.hits += 1
+                return flight['value'], True
+        try:
+            flight['value'] = compute()
+            self.put(key, flight['value'])
+        finally:
+            with self.lock:
+                del self.computing[key]
+            flight['done'].set()
+        return flight['value'], False
+
+    def nbytes(self):
+        with self.lock:
+            return sum(cached_nbytes(entry[0]) for entry in self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+def result_cache_key(method_selection, X1, X2, toggles, Main, G, R, C_list, not_wanted_in_sum, top_k=None):
+    """
+    Canonical key for a run. The results only depend on the multiset of each
+    list (and the set of the Not Wanted List), so the contents are sorted.
+    """
+    return (
+        method_selection, int(X1), int(X2), tuple(bool(t) for t in toggles),
+        tuple(sorted(Main)), tuple(sorted(G)), tuple(sorted(R)), tuple(sorted(C_list)),
+        tuple(sorted(set(not_wanted_in_sum))), int(top_k or 0),
+    )
+
+def candidate_cache_key(method_selection, X1, X2, Main, G, R, C_list):
+    """Key of the ranked_candidates of a run: everything but the Not Wanted List, toggles and top K."""
+    return (
+        method_selection, int(X1), int(X2),
+        tuple(sorted(Main)), tuple(sorted(G)), tuple(sorted(R)), tuple(sorted(C_list)),
+    )
+
+# ---------------------------------------------------------------
+# Jobs: a run described as a plain mapping, as read by the CLI from flags
+# and job files and by the API from request bodies.
+# ---------------------------------------------------------------
+LIST_FIELDS = {
+    'priority': DEFAULT_MAIN,
+    'second': DEFAULT_G,
+    'third': DEFAULT_R,
+    'backup': DEFAULT_C_LIST,
+    'not_wanted': DEFAULT_NWIM,
+}
+# Same defaults as the toggles in the Streamlit page, in pipeline order
+TOGGLE_FIELDS = {
+    'strict_main_sub': True,
+    'strict_intermediate': False,
+    'strict_total': False,
+    'strict_gen': False,
+    'strict_exterior': False,
+}
+JOB_DEFAULTS = dict(method='dual', X1=5, X2=15, top_k=0, **LIST_FIELDS, **TOGGLE_FIELDS)
+# Largest magnitude of X1, X2 and list values in a job, as for pasted lists
+JOB_VALUE_LIMIT = LIST_VALUE_LIMIT
+
+def job_int(field, value, low=-JOB_VALUE_LIMIT, high=JOB_VALUE_LIMIT):
+    """value as an int in [low, high]; ValueError for fractions, non-numbers and values out of range."""
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{field} must be an integer, got {value}")
+    number = int(value)
+    if not low <= number <= high:
+        raise ValueError(f"{field} must be between {low} and {high}, got {number}")
+    return number
+
+def job_bool(field, value):
+    """A toggle: true/false (or 0/1); ValueError for anything else, e.g. the string "false"."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise ValueError(f"{field} must be true or false, got {value!r}")
+
+def normalize_job(job, defaults=JOB_DEFAULTS, warnings=None):
+    """
+    Layer a job over the defaults and parse its lists. Malformed list
+    entries are skipped with a warning on stderr, or appended to warnings
+    when a list is given. Unknown keys or methods, numbers that are not
+    integers within JOB_VALUE_LIMIT (top_k: 0 or more) and toggles that are
+    not booleans raise ValueError.
+    """
+    unknown = set(job) - set(JOB_DEFAULTS) - {'name'}
+    if unknown:
+        raise ValueError(f"Unknown job keys: {', '.join(sorted(unknown))}")
+    merged = {**defaults, **job}
+    if merged['method'] not in ENUMERATORS:
+        raise ValueError(f"Unknown method: {merged['method']}")
+
+    for field in LIST_FIELDS:
+        value = merged[field]
+        if isinstance(value, str):
+            values, malformed = parse_int_array(value)
+            if malformed:
+                message = f"{field}: skipped {len(malformed)} malformed entries: {', '.join(malformed[:10])}"
+                if warnings is None:
+                    print(f"warning: {message}", file=sys.stderr)
+                else:
+                    warnings.append(message)
+            merged[field] = values.tolist()
+        else:
+            merged[field] = [job_int(field, x) for x in value]
+    merged['X1'] = job_int('X1', merged['X1'])
+    merged['X2'] = job_int('X2', merged['X2'])
+    merged['top_k'] = job_int('top_k', merged['top_k'] or 0, low=0)
+    for field in TOGGLE_FIELDS:
+        merged[field] = job_bool(field, merged[field])
+    return merged
+
+def run_job(job, cache=None, candidate_cache=None):
+    """
+    Run one normalized job and return the pipeline result (cached by inputs).
+    Jobs that share the method, X1/X2 and lists reuse the candidates in
+    candidate_cache and only re-filter them.
+    """
+    toggles = tuple(job[field] for field in TOGGLE_FIELDS)
+    lists = [job[field] for field in LIST_FIELDS]
+    key = result_cache_key(job['method'], job['X1'], job['X2'], toggles, *lists, top_k=job['top_k'])
+    result = cache.get(key) if cache is not None else None
+    if result is None:
+        result = run_pipeline(job['method'], job['X1'], job['X2'], toggles, *lists, top_k=job['top_k'],
+                              candidate_cache=candidate_cache)
+        if cache is not None:
+            cache.put(key, result)
+    return result
+
+# ---------------------------------------------------------------
+# Background runs: the page runs the pipeline on a worker thread and polls
+# it, so reruns never block on an enumeration and stale runs can be stopped.
+# ---------------------------------------------------------------
+class RunCancelled(Exception):
+    """Raised in a PipelineJob's thread at the next enumeration block after cancel()."""
+
+class PipelineJob:
+    """
+    compute(on_block) on a daemon thread, with a handle to poll and cancel
+    it. The job's on_block keeps the progress, the number of rows found so
+    far and the first preview_rows (tuples, bins) for display, and raises
+    RunCancelled once cancel() has been called, which stops the enumeration
+    at the next block. What compute returns ends up in result, what it
+    raises in error.
+    """
+    def __init__(self, key, compute, preview_rows=1000):
+        self.key = key
+        self.preview_rows = preview_rows
+        self.progress = 0.0
+        self.rows = 0
+        self.preview = []
+        self.result = None
+        self.error = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(compute,), name="pipeline-job", daemon=True)
+        self._thread.start()
+
+    def _run(self, compute):
+        try:
+            self.result = compute(self.on_block)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self._done.set()
+
+    def on_block(self, tuples, bins, progress):
+        if self._cancelled.is_set():
+            raise RunCancelled()
+        self.progress = min(progress, 1.0)
+        self.rows += len(tuples)
+        shown = sum(len(block) for block, _ in self.preview)
+        if len(tuples) and shown < self.preview_rows:
+            take = self.preview_rows - shown
+            self.preview.append((tuples[:take], bins[:take]))
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """True once compute has returned or raised, False if timeout seconds passed first."""
+        return self._done.wait(timeout)
@@ -0,0 +1,366 @@
+"""
+Local HTTP/JSON API for the Number Combinations Generator.
+
+Serves the pipeline of the Streamlit page to other tools. Built on
+Starlette and uvicorn, which Streamlit already installs.
+
+    python server.py --port 8765 --workers 4
+
+    curl -s localhost:8765/combinations -d '{"method": "dual", "X1": 5, "top_k": 10}'
+    curl -s 'localhost:8765/combinations?format=ndjson' -d '{"method": "single"}'
+    curl -s localhost:8765/combinations -H 'Accept: text/csv' -d @job.json > result.csv
+
+Endpoints:
+
+    GET  /health        status, pool and cache counters
+    GET  /methods       the methods, the job defaults and the formats
+    POST /combinations  run a job: a JSON object with the keys of a cli.py
+                        job (method, X1, X2, top_k, priority, second, third,
+                        backup, not_wanted and the strict_* toggles); missing
+                        keys take the defaults of the page
+
+/combinations answers with the ranked df_with_inter rows, in the format
+given by ?format= or the Accept header:
+
+    json    {"message", "method", "rows", "cached", "warnings",
+             "columns": [...], "data": [[...], ...]}  (the default)
+    ndjson  one JSON object per row, streamed
+    csv     the CSV export, streamed
+
+The X-Rows, X-Cached and X-Warnings headers carry the same details for the
+streamed formats.
+
+The enumeration runs in a pool of --workers processes. At most
+--max-pending jobs may be running or queued for the pool; beyond that
+requests get 503 with Retry-After. Results are kept in an LRU
+ResultCache keyed by the normalized job. Identical requests that arrive
+while that job is running share its run. Each worker keeps a candidate
+cache, so jobs that only change the Not Wanted List or the toggles just
+re-filter.
+
+Request bodies are limited to 16 MB and heads to 64 KB. A client gets
+REQUEST_TIMEOUT seconds to send each request and KEEP_ALIVE_TIMEOUT
+seconds of idle time between requests before its connection is closed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from concurrent.futures import ProcessPoolExecutor
+
+import h11
+import uvicorn
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from uvicorn.protocols.http.h11_impl import H11Protocol
+
+from combinations_core import (
+    CANDIDATE_CACHE_SIZE,
+    COMBINATION_RULES,
+    JOB_DEFAULTS,
+    LIST_FIELDS,
+    RESULT_CACHE_SIZE,
+    TOGGLE_FIELDS,
+    ResultCache,
+    iter_csv_chunks,
+    normalize_job,
+    result_cache_key,
+    run_job,
+)
+
+logger = logging.getLogger("combinations.server")
+
+# format -> Content-Type
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+# Rows encoded per chunk of a streamed response
+STREAM_CHUNK_ROWS = 10_000
+MAX_HEAD_BYTES = 64 * 2**10
+MAX_BODY_BYTES = 16 * 2**20
+# Seconds a client gets to send a whole request, and to send the next one on a kept-alive connection
+REQUEST_TIMEOUT = 30
+KEEP_ALIVE_TIMEOUT = 5
+
+
+class TimedH11Protocol(H11Protocol):
+    """
+    uvicorn's h11 protocol with a deadline for reading each request. Its own
+    keep-alive timeout is reset by every byte received, so a client trickling
+    in a head or body would otherwise hold the connection forever.
+    """
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.request_deadline = None
+        self._arm_request_deadline()
+
+    def on_response_complete(self):
+        super().on_response_complete()
+        self._arm_request_deadline()
+
+    def connection_lost(self, exc):
+        if self.request_deadline is not None:
+            self.request_deadline.cancel()
+        super().connection_lost(exc)
+
+    def _arm_request_deadline(self):
+        if self.request_deadline is not None:
+            self.request_deadline.cancel()
+        self.request_deadline = self.loop.call_later(REQUEST_TIMEOUT, self._request_timed_out)
+
+    def _request_timed_out(self):
+        # Still reading the head or the body; a request being answered is left alone
+        if self.conn.their_state in (h11.IDLE, h11.SEND_BODY) and not self.transport.is_closing():
+            self.transport.close()
+
+
+def json_bytes(value):
+    return json.dumps(value).encode('utf-8')
+
+
+def response_format(request):
+    """json, ndjson or csv, from ?format= or else the Accept header."""
+    name = request.query_params.get('format')
+    if name is None:
+        accept = request.headers.get('accept', '')
+        name = next((fmt for fmt in ('ndjson', 'csv') if FORMATS[fmt].split(';')[0] in accept), 'json')
+    if name not in FORMATS:
+        raise HTTPException(400, f"unknown format {name!r}, expected one of {', '.join(FORMATS)}")
+    return name
+
+
+async def iter_ndjson(df_with_inter):
+    for start in range(0, len(df_with_inter), STREAM_CHUNK_ROWS):
+        chunk = df_with_inter.iloc[start:start + STREAM_CHUNK_ROWS]
+        text = await asyncio.to_thread(chunk.to_json, orient='records', lines=True)
+        yield text.encode('utf-8') if text.endswith('\n') else (text + '\n').encode('utf-8')
+
+
+async def iter_csv(df_with_inter):
+    chunks = iter_csv_chunks(df_with_inter, STREAM_CHUNK_ROWS)
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        yield chunk
+
+
+def json_result_body(result, cached, warnings):
+    """The json response body. The rows are encoded once per result and kept on it."""
+    if 'rows_json' not in result:
+        # {"columns": [...], "data": [[...], ...]}
+        result['rows_json'] = result['df_with_inter'].to_json(orient='split', index=False).encode('utf-8')
+    meta = json_bytes({
+        'message': result['message'],
+        'method': result['method'],
+        'rows': len(result['df_with_inter']),
+        'cached': cached,
+        'warnings': warnings,
+    })
+    return meta[:-1] + b', ' + result['rows_json'][1:]
+
+
+# Per-process state of a pool worker
+_worker_state = {}
+
+
+def _init_worker():
+    _worker_state['candidate_cache'] = ResultCache(CANDIDATE_CACHE_SIZE)
+
+
+def _compute(job):
+    """Run a normalized job in a pool worker; only what the API sends back is returned."""
+    result = run_job(job, candidate_cache=_worker_state.get('candidate_cache'))
+    return {'message': result['message'], 'method': result['method'], 'df_with_inter': result['df_with_inter']}
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class CombinationsServer:
+    """Routes requests and runs jobs on the process pool, with the result cache in front of it."""
+    def __init__(self, workers=None, max_pending=None, cache_size=RESULT_CACHE_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        # spawn, not fork: the event loop's threads must not be copied into the workers
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        self.cache = ResultCache(cache_size)
+        self.in_flight = {}  # cache key -> task computing it
+        self.pending = 0
+        self.served = 0
+
+    async def warm_up(self):
+        """Start every worker process now rather than on the first requests."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _warm_up) for _ in range(self.workers)])
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def result_for(self, job):
+        """(result, cached) for a normalized job."""
+        toggles = tuple(job[field] for field in TOGGLE_FIELDS)
+        lists = [job[field] for field in LIST_FIELDS]
+        key = result_cache_key(job['method'], job['X1'], job['X2'], toggles, *lists, top_k=job['top_k'])
+        result = self.cache.get(key)
+        if result is not None:
+            return result, True
+        task = self.in_flight.get(key)
+        if task is None:
+            if self.pending >= self.max_pending:
+                raise HTTPException(503, "too many jobs pending, retry later", {'Retry-After': '1'})
+            task = asyncio.ensure_future(self._compute(key, job))
+            self.in_flight[key] = task
+        # shielded: a client hanging up does not cancel a run others may be waiting on
+        return await asyncio.shield(task), False
+
+    async def _compute(self, key, job):
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.pool, _compute, job)
+        finally:
+            self.pending -= 1
+            del self.in_flight[key]
+        self.cache.put(key, result)
+        return result
+
+    def app(self):
+        """The Starlette application serving the endpoints."""
+        return Starlette(
+            routes=[
+                Route('/health', self.health, methods=['GET']),
+                Route('/methods', self.methods, methods=['GET']),
+                Route('/combinations', self.combinations, methods=['POST']),
+            ],
+            exception_handlers={HTTPException: http_error, Exception: internal_error},
+        )
+
+    async def health(self, request):
+        self.served += 1
+        return json_response({
+            'status': 'ok',
+            'workers': self.workers,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'served': self.served,
+            'cache': {'entries': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses},
+        })
+
+    async def methods(self, request):
+        self.served += 1
+        return json_response({
+            'methods': sorted(COMBINATION_RULES),
+            'defaults': JOB_DEFAULTS,
+            'formats': list(FORMATS),
+        })
+
+    async def combinations(self, request):
+        self.served += 1
+        fmt = response_format(request)
+        try:
+            job = json.loads(await read_body(request) or b'{}')
+        except ValueError:
+            raise HTTPException(400, "the body is not valid JSON")
+        if not isinstance(job, dict):
+            raise HTTPException(400, "the body must be a JSON object")
+        warnings = []
+        try:
+            job = normalize_job(job, warnings=warnings)
+        except (TypeError, ValueError) as exc:
+            raise HTTPException(400, str(exc))
+
+        result, cached = await self.result_for(job)
+        df_with_inter = result['df_with_inter']
+        headers = {
+            'X-Rows': str(len(df_with_inter)),
+            'X-Cached': 'true' if cached else 'false',
+        }
+        if warnings:
+            headers['X-Warnings'] = json.dumps(warnings)
+        if fmt == 'json':
+            body = await asyncio.to_thread(json_result_body, result, cached, warnings)
+            return Response(body, headers=headers, media_type=FORMATS[fmt])
+        rows = iter_ndjson(df_with_inter) if fmt == 'ndjson' else iter_csv(df_with_inter)
+        return StreamingResponse(rows, headers=headers, media_type=FORMATS[fmt])
+
+
+async def read_body(request):
+    """The request body, or 413 once it grows past MAX_BODY_BYTES."""
+    length = request.headers.get('content-length')
+    if length is not None and int(length) > MAX_BODY_BYTES:
+        raise HTTPException(413, f"request body over {MAX_BODY_BYTES} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPException(413, f"request body over {MAX_BODY_BYTES} bytes")
+    return bytes(body)
+
+
+def json_response(value, status=200, headers=None):
+    return Response(json_bytes(value), status, headers, media_type=FORMATS['json'])
+
+
+async def http_error(request, exc):
+    return json_response({'error': exc.detail}, exc.status_code, exc.headers)
+
+
+async def internal_error(request, exc):
+    logger.error("request failed", exc_info=exc)
+    return json_response({'error': 'internal error'}, 500)
+
+
+async def serve(host, port, workers=None, max_pending=None, cache_size=RESULT_CACHE_SIZE, log_level='warning'):
+    server = CombinationsServer(workers, max_pending, cache_size)
+    config = uvicorn.Config(
+        server.app(), http=TimedH11Protocol, lifespan='off', log_config=None, log_level=log_level,
+        timeout_keep_alive=KEEP_ALIVE_TIMEOUT, h11_max_incomplete_event_size=MAX_HEAD_BYTES,
+    )
+    try:
+        await server.warm_up()
+        # Bound before "serving on" is printed, so clients can connect as soon as they read it
+        listener = socket.create_server((host, port))
+        address = listener.getsockname()
+        print(f"serving on http://{address[0]}:{address[1]} with {server.workers} workers", flush=True)
+        # uvicorn shuts down gracefully on SIGTERM, then re-raises it; raised as
+        # KeyboardInterrupt like Ctrl-C, so the pool workers are shut down too
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        await uvicorn.Server(config).serve(sockets=[listener])
+    finally:
+        server.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="enumeration processes (default: all cores)")
+    parser.add_argument("--max-pending", dest="max_pending", type=int,
+                        help="jobs running or queued before 503 (default: 4 per worker)")
+    parser.add_argument("--cache-size", dest="cache_size", type=int, default=RESULT_CACHE_SIZE,
+                        help="results kept in the LRU cache")
+    parser.add_argument("--log-level", dest="log_level", default="WARNING",
+                        help="INFO logs every request (uvicorn's access log)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(message)s")
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_pending, args.cache_size,
+                          args.log_level.lower()))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()